@@ -4,6 +4,14 @@ __all__ = [
     "repositories",
     "auth",
     "workflows",
+    "attribution",
+    "retention",
+    "related",
+    "dedupe",
+    "generation",
+    "sitemap",
+    "click_filter",
+    "profiling",
     "settings",
     "utils",
 ]
\ No newline at end of file
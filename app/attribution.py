@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .database import get_connection
+from .utils import utc_now_iso
+from . import repositories as repo
+
+
+WATERMARK_KEY = "attribution_watermark"
+DEFAULT_LOOKBACK_DAYS = 30
+DEFAULT_COMMISSION_RATE = 0.05
+_FLUSH_EVERY = 10000
+
+
+def _tuple_cursor(conn):
+    # Plain tuples are noticeably cheaper than sqlite3.Row on multi-million row scans
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur
+
+
+def _iter_orders(conn, after_id: int, until_id: int) -> Iterator[Tuple]:
+    return _tuple_cursor(conn).execute(
+        "SELECT id, product_id, affiliate_id, price, created_at FROM orders "
+        "WHERE id > ? AND id <= ? ORDER BY product_id, created_at",
+        (after_id, until_id),
+    )
+
+
+def _iter_clicks(conn, since: str, until: str) -> Iterator[Tuple]:
+    # Served straight from idx_clicks_product_created, no table lookups or sorting
+    return _tuple_cursor(conn).execute(
+        "SELECT product_id, created_at, affiliate_id, id FROM clicks "
+        "WHERE affiliate_id IS NOT NULL AND created_at >= ? AND created_at <= ? "
+        "ORDER BY product_id, created_at",
+        (since, until),
+    )
+
+
+def _order_time_bounds(conn, after_id: int, until_id: int) -> Tuple[Optional[str], Optional[str]]:
+    row = conn.execute(
+        "SELECT MIN(created_at), MAX(created_at) FROM orders WHERE id > ? AND id <= ?",
+        (after_id, until_id),
+    ).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+def _shift_iso(value: str, delta: timedelta) -> str:
+    return (datetime.fromisoformat(value) - delta).isoformat()
+
+
+def _flush(conn, attributions: List[Tuple], cleared: List[int], totals: Dict[int, List[float]]) -> None:
+    # Orders seen before (the watermark was reset) already count towards some
+    # affiliate's totals; take their previous attribution out first so a re-run
+    # replaces it instead of adding to it
+    order_ids = [a[0] for a in attributions] + cleared
+    for i in range(0, len(order_ids), 500):
+        chunk = order_ids[i:i + 500]
+        previous = conn.execute(
+            "SELECT a.affiliate_id, o.price, a.commission FROM order_attributions a "
+            f"JOIN orders o ON o.id = a.order_id WHERE a.order_id IN ({','.join('?' for _ in chunk)})",
+            chunk,
+        ).fetchall()
+        for affiliate_id, price, commission in previous:
+            total = totals.setdefault(affiliate_id, [0, 0.0, 0.0])
+            total[0] -= 1
+            total[1] -= float(price)
+            total[2] -= commission
+    if cleared:
+        conn.executemany("DELETE FROM order_attributions WHERE order_id = ?", [(order_id,) for order_id in cleared])
+        cleared.clear()
+    if attributions:
+        conn.executemany(
+            "INSERT OR REPLACE INTO order_attributions (order_id, affiliate_id, click_id, commission, created_at) "
+            "VALUES (?,?,?,?,?)",
+            attributions,
+        )
+        attributions.clear()
+
+
+def _get_lookback_days() -> int:
+    return int(repo.get_setting("attribution_lookback_days", str(DEFAULT_LOOKBACK_DAYS)) or DEFAULT_LOOKBACK_DAYS)
+
+
+def oldest_click_needed() -> str:
+    # Clicks from this time on may still be used by run_attribution: the
+    # lookback window before now, and before the oldest order it has not
+    # processed yet. app.retention never archives past this point.
+    lookback = timedelta(days=_get_lookback_days())
+    oldest = (datetime.now(timezone.utc) - lookback).isoformat()
+    after_id = int(repo.get_setting(WATERMARK_KEY, "0") or 0)
+    row = get_connection().execute("SELECT MIN(created_at) FROM orders WHERE id > ?", (after_id,)).fetchone()
+    if row and row[0]:
+        oldest = min(oldest, _shift_iso(row[0], lookback))
+    return oldest
+
+
+def run_attribution(
+    lookback_days: Optional[int] = None,
+    commission_rate: Optional[float] = None,
+) -> Dict[str, int]:
+    # Orders with an affiliate keep it; the rest go to the last click on the same
+    # product within the lookback window. Orders and clicks are both streamed in
+    # (product_id, created_at) order and merged in one pass. Only orders past the
+    # watermark are processed; the watermark moves in the same transaction.
+    if lookback_days is None:
+        lookback_days = _get_lookback_days()
+    if commission_rate is None:
+        commission_rate = float(repo.get_setting("commission_rate", str(DEFAULT_COMMISSION_RATE)) or DEFAULT_COMMISSION_RATE)
+    lookback = timedelta(days=lookback_days)
+
+    conn = get_connection()
+    after_id = int(repo.get_setting(WATERMARK_KEY, "0") or 0)
+    until_id = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0])
+    result = {"orders": 0, "direct": 0, "attributed": 0, "unattributed": 0}
+    if until_id <= after_id:
+        return result
+
+    first_ts, last_ts = _order_time_bounds(conn, after_id, until_id)
+    if first_ts is None:
+        return result
+    clicks = _iter_clicks(conn, _shift_iso(first_ts, lookback), last_ts)
+    click = next(clicks, None)
+    current_product = None
+    last_click = None
+
+    now = utc_now_iso()
+    attributions: List[Tuple] = []
+    cleared: List[int] = []
+    totals: Dict[int, List[float]] = {}
+    for order_id, product_id, affiliate_id, price, created_at in _iter_orders(conn, after_id, until_id):
+        result["orders"] += 1
+        if product_id != current_product:
+            current_product = product_id
+            last_click = None
+        # Advance the click stream up to this order, remembering the latest click on this product
+        while click is not None and (click[0] < product_id or (click[0] == product_id and click[1] <= created_at)):
+            if click[0] == product_id:
+                last_click = click
+            click = next(clicks, None)
+
+        click_id = None
+        if affiliate_id is not None:
+            result["direct"] += 1
+        elif last_click is not None and last_click[1] >= _shift_iso(created_at, lookback):
+            affiliate_id = last_click[2]
+            click_id = last_click[3]
+            result["attributed"] += 1
+        else:
+            result["unattributed"] += 1
+            cleared.append(order_id)
+            continue
+
+        commission = float(price) * commission_rate
+        attributions.append((order_id, affiliate_id, click_id, commission, now))
+        total = totals.setdefault(affiliate_id, [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += float(price)
+        total[2] += commission
+        if len(attributions) + len(cleared) >= _FLUSH_EVERY:
+            _flush(conn, attributions, cleared, totals)
+
+    _flush(conn, attributions, cleared, totals)
+    conn.executemany(
+        """
+        INSERT INTO affiliate_commissions (affiliate_id, orders_count, revenue, commission, updated_at)
+        VALUES (?,?,?,?,?)
+        ON CONFLICT(affiliate_id) DO UPDATE SET
+            orders_count = orders_count + excluded.orders_count,
+            revenue = revenue + excluded.revenue,
+            commission = commission + excluded.commission,
+            updated_at = excluded.updated_at
+        """,
+        [(aff_id, int(t[0]), t[1], t[2], now) for aff_id, t in totals.items()],
+    )
+    repo.set_setting(WATERMARK_KEY, str(until_id), commit=False)
+    conn.commit()
+    return result
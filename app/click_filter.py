@@ -0,0 +1,163 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Hashable, List, Mapping, Optional
+
+from . import repositories as repo
+
+
+DEFAULT_DEDUPE_WINDOW_SECONDS = 30
+DEFAULT_RATE_WINDOW_SECONDS = 60
+DEFAULT_FINGERPRINT_LIMIT = 20
+DEFAULT_REFERRER_LIMIT = 600
+DEFAULT_MAX_KEYS_PER_BUCKET = 50000
+_BUCKETS = 6
+
+
+class _BucketRing:
+    # A sliding window split into fixed time buckets. Each bucket holds a dict
+    # of counters and is wiped when the ring wraps around to it, so memory is
+    # bounded by buckets * max_keys regardless of traffic.
+
+    def __init__(self, window_seconds: float, max_keys: int, buckets: int = _BUCKETS):
+        self.width = window_seconds / buckets
+        self.max_keys = max_keys
+        self.epochs: List[int] = [-1] * buckets
+        self.counters: List[Dict[Hashable, int]] = [{} for _ in range(buckets)]
+
+    def _current(self, now: float) -> Dict[Hashable, int]:
+        epoch = int(now / self.width)
+        slot = epoch % len(self.epochs)
+        if self.epochs[slot] != epoch:
+            self.epochs[slot] = epoch
+            self.counters[slot] = {}
+        return self.counters[slot]
+
+    def count(self, key: Hashable, now: float) -> int:
+        oldest = int(now / self.width) - len(self.epochs) + 1
+        total = 0
+        for epoch, counters in zip(self.epochs, self.counters):
+            if epoch >= oldest:
+                total += counters.get(key, 0)
+        return total
+
+    def add(self, key: Hashable, now: float) -> bool:
+        counters = self._current(now)
+        if key in counters:
+            counters[key] += 1
+        elif len(counters) < self.max_keys:
+            counters[key] = 1
+        else:
+            return False  # bucket full: stop tracking new keys rather than grow
+        return True
+
+
+class ClickFilter:
+    # Drops repeated (product, affiliate, fingerprint) clicks inside the dedupe
+    # window, and clicks from fingerprints or referrers above their rate limit
+    # inside the rate window. Fail-open: when a bucket is full, or a click has
+    # no fingerprint to tell shoppers apart, clicks pass.
+
+    def __init__(
+        self,
+        dedupe_window_seconds: float = DEFAULT_DEDUPE_WINDOW_SECONDS,
+        rate_window_seconds: float = DEFAULT_RATE_WINDOW_SECONDS,
+        fingerprint_limit: int = DEFAULT_FINGERPRINT_LIMIT,
+        referrer_limit: int = DEFAULT_REFERRER_LIMIT,
+        max_keys_per_bucket: int = DEFAULT_MAX_KEYS_PER_BUCKET,
+    ):
+        self.fingerprint_limit = fingerprint_limit
+        self.referrer_limit = referrer_limit
+        self._events = _BucketRing(dedupe_window_seconds, max_keys_per_bucket)
+        self._fingerprints = _BucketRing(rate_window_seconds, max_keys_per_bucket)
+        self._referrers = _BucketRing(rate_window_seconds, max_keys_per_bucket)
+        self._lock = threading.Lock()
+        self.stats = {
+            "seen": 0,
+            "allowed": 0,
+            "duplicate": 0,
+            "fingerprint_rate": 0,
+            "referrer_rate": 0,
+            "untracked": 0,
+        }
+
+    def allow(
+        self,
+        product_id: int,
+        affiliate_id: Optional[int],
+        fingerprint: Optional[str],
+        referrer: Optional[str] = None,
+        now: Optional[float] = None,
+    ) -> bool:
+        if now is None:
+            now = time.monotonic()
+        stats = self.stats
+        with self._lock:
+            stats["seen"] += 1
+            event = (product_id, affiliate_id, fingerprint)
+            if fingerprint is not None and self._events.count(event, now):
+                stats["duplicate"] += 1
+                return False
+            if fingerprint is not None and self._fingerprints.count(fingerprint, now) >= self.fingerprint_limit:
+                stats["fingerprint_rate"] += 1
+                return False
+            if referrer and self._referrers.count(referrer, now) >= self.referrer_limit:
+                stats["referrer_rate"] += 1
+                return False
+            if fingerprint is not None:
+                if not self._events.add(event, now):
+                    stats["untracked"] += 1
+                self._fingerprints.add(fingerprint, now)
+            if referrer:
+                self._referrers.add(referrer, now)
+            stats["allowed"] += 1
+            return True
+
+    def suppressed(self) -> int:
+        return self.stats["duplicate"] + self.stats["fingerprint_rate"] + self.stats["referrer_rate"]
+
+
+_default_filter: Optional[ClickFilter] = None
+_default_lock = threading.Lock()
+
+
+def get_click_filter() -> ClickFilter:
+    # Process-wide filter configured from settings on first use
+    global _default_filter
+    with _default_lock:
+        if _default_filter is None:
+            _default_filter = ClickFilter(
+                dedupe_window_seconds=float(repo.get_setting("click_dedupe_window_seconds", str(DEFAULT_DEDUPE_WINDOW_SECONDS)) or DEFAULT_DEDUPE_WINDOW_SECONDS),
+                rate_window_seconds=float(repo.get_setting("click_rate_window_seconds", str(DEFAULT_RATE_WINDOW_SECONDS)) or DEFAULT_RATE_WINDOW_SECONDS),
+                fingerprint_limit=int(repo.get_setting("click_fingerprint_limit", str(DEFAULT_FINGERPRINT_LIMIT)) or DEFAULT_FINGERPRINT_LIMIT),
+                referrer_limit=int(repo.get_setting("click_referrer_limit", str(DEFAULT_REFERRER_LIMIT)) or DEFAULT_REFERRER_LIMIT),
+            )
+        return _default_filter
+
+
+def client_fingerprint(headers: Optional[Mapping[str, str]]) -> Optional[str]:
+    # Client address (first X-Forwarded-For hop) plus browser headers, hashed.
+    # None when the request carries none of them.
+    if not headers:
+        return None
+    lowered = {k.lower(): v for k, v in headers.items()}
+    parts = [
+        (lowered.get("x-forwarded-for") or "").split(",")[0].strip(),
+        lowered.get("user-agent") or "",
+        lowered.get("accept-language") or "",
+    ]
+    if not any(parts):
+        return None
+    return hashlib.blake2b("\0".join(parts).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def log_click_filtered(
+    product_id: int,
+    affiliate_id: Optional[int],
+    referrer: Optional[str],
+    fingerprint: Optional[str],
+) -> Optional[int]:
+    # Returns the new click id, or None when the click was suppressed
+    if not get_click_filter().allow(product_id, affiliate_id, fingerprint, referrer):
+        return None
+    return repo.log_click(product_id, affiliate_id, referrer)
@@ -1,8 +1,23 @@
+import os
 import sqlite3
-from .settings import get_db_path
+import threading
+import time
+from typing import Optional, Tuple
+
+from .settings import get_db_path, get_snapshot_path
 
 
 _connection_cache = None
+_snapshot_cache = None
+_snapshot_retired = None
+_snapshot_inode = None
+_snapshot_lock = threading.Lock()
+
+# Tables the public pages read; everything else stays on the primary only
+SNAPSHOT_TABLES = ("settings", "categories", "products", "blog_posts", "related_products", "price_history", "product_groups")
+DEFAULT_SNAPSHOT_MAX_AGE_SECONDS = 60
+_MAX_AGE_TTL_SECONDS = 5.0
+_max_age_cache: Tuple[float, int] = (0.0, DEFAULT_SNAPSHOT_MAX_AGE_SECONDS)
 
 
 def get_connection() -> sqlite3.Connection:
@@ -18,6 +33,7 @@ def init_db(conn: sqlite3.Connection) -> None:
     cur = conn.cursor()
     cur.executescript(
         """
+    PRAGMA auto_vacuum=INCREMENTAL;
     PRAGMA journal_mode=WAL;
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -93,6 +109,198 @@ def init_db(conn: sqlite3.Connection) -> None:
         nodes_json TEXT NOT NULL,
         created_at TEXT NOT NULL
     );
+    CREATE TABLE IF NOT EXISTS order_attributions (
+        order_id INTEGER PRIMARY KEY,
+        affiliate_id INTEGER NOT NULL,
+        click_id INTEGER,
+        commission REAL NOT NULL,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(order_id) REFERENCES orders(id),
+        FOREIGN KEY(affiliate_id) REFERENCES affiliates(id),
+        FOREIGN KEY(click_id) REFERENCES clicks(id)
+    );
+    CREATE TABLE IF NOT EXISTS affiliate_commissions (
+        affiliate_id INTEGER PRIMARY KEY,
+        orders_count INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        commission REAL NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY(affiliate_id) REFERENCES affiliates(id)
+    );
+    CREATE TABLE IF NOT EXISTS click_daily_rollups (
+        day TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        affiliate_id INTEGER NOT NULL DEFAULT 0,
+        clicks INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(day, product_id, affiliate_id)
+    );
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        prompt_hash TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS related_products (
+        product_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        related_product_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY(product_id, rank)
+    ) WITHOUT ROWID;
+    -- One row per price change only; epoch seconds and integer cents keep rows small
+    CREATE TABLE IF NOT EXISTS price_history (
+        product_id INTEGER NOT NULL,
+        recorded_at INTEGER NOT NULL,
+        price_cents INTEGER NOT NULL,
+        PRIMARY KEY(product_id, recorded_at)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_price_history_recorded ON price_history(recorded_at);
+    CREATE TABLE IF NOT EXISTS product_minhash (
+        product_id INTEGER PRIMARY KEY,
+        text_hash INTEGER NOT NULL,
+        numbers_hash INTEGER NOT NULL,
+        signature BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS product_lsh_buckets (
+        band INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        PRIMARY KEY(band, bucket, product_id)
+    ) WITHOUT ROWID;
+    -- Only products with at least one duplicate; the canonical product points at itself
+    CREATE TABLE IF NOT EXISTS product_groups (
+        product_id INTEGER PRIMARY KEY,
+        canonical_id INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_product_groups_canonical ON product_groups(canonical_id);
+    CREATE INDEX IF NOT EXISTS idx_clicks_product_created ON clicks(product_id, created_at, affiliate_id);
+    CREATE INDEX IF NOT EXISTS idx_orders_product_created ON orders(product_id, created_at);
+    -- API keys are read from the environment only; drop one saved by older versions
+    DELETE FROM settings WHERE key = 'llm_api_key';
     """
     )
-    conn.commit()
\ No newline at end of file
+    conn.commit()
+
+
+def publish_snapshot() -> None:
+    with _snapshot_lock:
+        _publish_snapshot_locked()
+
+
+def _publish_in_background() -> None:
+    if not _snapshot_lock.acquire(blocking=False):
+        return  # a publish is already running
+
+    def run() -> None:
+        try:
+            _publish_snapshot_locked()
+        finally:
+            _snapshot_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _publish_snapshot_locked() -> None:
+    # Copies the snapshot tables inside one read transaction on the primary, so
+    # the copy is consistent, into a temporary file next to the snapshot, then
+    # swaps it into place with an atomic rename. Staged on disk rather than in
+    # memory, so publishing costs no RAM however large the catalog grows.
+    snapshot_path = get_snapshot_path()
+    tmp_path = snapshot_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)  # left over from an interrupted publish
+    tmp = sqlite3.connect(tmp_path)
+    try:
+        # A scratch file until the rename; no journal or fsync needed while filling it
+        tmp.execute("PRAGMA journal_mode=OFF")
+        tmp.execute("PRAGMA synchronous=OFF")
+        tmp.execute("ATTACH DATABASE ? AS src", (get_db_path(),))
+        tmp.execute("BEGIN")
+        placeholders = ",".join("?" for _ in SNAPSHOT_TABLES)
+        schema = tmp.execute(
+            "SELECT type, name, sql FROM src.sqlite_master "
+            f"WHERE tbl_name IN ({placeholders}) AND sql IS NOT NULL "
+            "ORDER BY CASE type WHEN 'table' THEN 0 ELSE 1 END",
+            SNAPSHOT_TABLES,
+        ).fetchall()
+        for obj_type, name, sql in schema:
+            tmp.execute(sql)
+            if obj_type == "table":
+                tmp.execute(f"INSERT INTO main.{name} SELECT * FROM src.{name}")
+        tmp.commit()
+        tmp.execute("DETACH DATABASE src")
+    except BaseException:
+        tmp.close()
+        os.remove(tmp_path)
+        raise
+    tmp.close()
+    os.replace(tmp_path, snapshot_path)
+
+
+def _open_snapshot() -> Optional[sqlite3.Connection]:
+    global _snapshot_cache, _snapshot_inode, _snapshot_retired
+    try:
+        inode = os.stat(get_snapshot_path()).st_ino
+    except FileNotFoundError:
+        return None
+    if _snapshot_cache is None or inode != _snapshot_inode:
+        conn = sqlite3.connect(
+            f"file:{get_snapshot_path()}?mode=ro", uri=True, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        # Reruns that picked up the previous connection may still be reading
+        # from it, so it is kept for one more publish; the one before it has
+        # had a full publish interval to finish and is closed, releasing the
+        # handle on its unlinked file
+        if _snapshot_retired is not None:
+            _snapshot_retired.close()
+        _snapshot_retired = _snapshot_cache
+        _snapshot_cache = conn
+        _snapshot_inode = inode
+    return _snapshot_cache
+
+
+def get_snapshot_max_age() -> int:
+    # Always read from the primary: the snapshot's copy of the setting lags
+    # behind by up to the old max age after it is changed in Admin
+    row = get_connection().execute(
+        "SELECT value FROM settings WHERE key = 'snapshot_max_age_seconds'"
+    ).fetchone()
+    try:
+        return int(row[0]) if row and row[0] else DEFAULT_SNAPSHOT_MAX_AGE_SECONDS
+    except ValueError:
+        return DEFAULT_SNAPSHOT_MAX_AGE_SECONDS
+
+
+def _cached_snapshot_max_age() -> int:
+    # Re-read every few seconds rather than on every public page rerun
+    global _max_age_cache
+    expires, value = _max_age_cache
+    now = time.monotonic()
+    if now >= expires:
+        value = get_snapshot_max_age()
+        _max_age_cache = (now + _MAX_AGE_TTL_SECONDS, value)
+    return value
+
+
+def get_snapshot_age() -> Optional[float]:
+    try:
+        return max(0.0, time.time() - os.stat(get_snapshot_path()).st_mtime)
+    except FileNotFoundError:
+        return None
+
+
+def get_read_connection() -> sqlite3.Connection:
+    # Read-only connection to the published snapshot for public pages. The first
+    # caller publishes synchronously; once the snapshot is older than the
+    # configured max age, it is republished in the background while readers keep
+    # using the current one.
+    conn = _open_snapshot()
+    if conn is None:
+        get_connection()
+        publish_snapshot()
+        return _open_snapshot()
+    age = get_snapshot_age()
+    if age is not None and age > _cached_snapshot_max_age():
+        _publish_in_background()
+    return conn
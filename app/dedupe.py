@@ -0,0 +1,364 @@
+import re
+import unicodedata
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .database import get_connection
+from . import repositories as repo
+
+
+WATERMARK_KEY = "dedupe_watermark"
+SIMILARITY_KEY = "dedupe_similarity"
+DEFAULT_SIMILARITY = 0.6
+# 16 bands of 4 rows: pairs above ~0.5 estimated Jaccard share a bucket in at
+# least one band with high probability; candidates are then checked against
+# the similarity setting using the full signatures.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+TITLE_NGRAM = 4
+DESCRIPTION_TOKENS = 50
+DESCRIPTION_CHARS = 1000  # enough for DESCRIPTION_TOKENS; long descriptions are not read in full
+CHUNK_SIZE = 1000
+# Buckets this crowded (a very generic title) are only checked against their
+# first members, which keeps a full rebuild from going quadratic.
+MAX_BUCKET_PAIRS = 64
+
+_PRIME = np.uint64(4294967291)  # largest prime below 2**32, so values fit in uint32
+_rng = np.random.default_rng(20240611)  # fixed: stored signatures must stay comparable
+_A = _rng.integers(1, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+_BAND_MIX = _rng.integers(1, 2 ** 63, size=(BANDS, ROWS), dtype=np.uint64) | np.uint64(1)
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_NUMBER_RE = re.compile(r"[0-9]+")
+
+
+def _tokens(text: Optional[str]) -> List[str]:
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _shingles(title: Optional[str], description: Optional[str]) -> Set[str]:
+    # Character n-grams of the title with spaces and punctuation removed, so
+    # "WH-1000XM5 Noise-Cancelling" matches "WH1000XM5 Noise Cancelling",
+    # plus word pairs from the opening of the description (single words are
+    # shared by most descriptions and would make every product look alike)
+    compact = "".join(_tokens(title))
+    shingles = {compact[i:i + TITLE_NGRAM] for i in range(max(1, len(compact) - TITLE_NGRAM + 1))}
+    shingles.discard("")
+    words = _tokens(description)[:DESCRIPTION_TOKENS]
+    shingles.update(map(" ".join, zip(words, words[1:])))
+    return shingles
+
+
+def _text_hash(title: Optional[str], description: Optional[str]) -> int:
+    return zlib.crc32(f"{title or ''}\x00{description or ''}".encode("utf-8"))
+
+
+def _numbers_hash(title: Optional[str]) -> int:
+    # Titles that differ only in a number (XM4 vs XM5, 128GB vs 256GB) are
+    # similar text but different products; duplicates must agree on these
+    return zlib.crc32(" ".join(sorted(set(_NUMBER_RE.findall(title or "")))).encode("ascii"))
+
+
+def _signatures(shingle_sets: Sequence[Set[str]]) -> np.ndarray:
+    # MinHash over (a*x + b) mod p for NUM_PERM random (a, b); one row per
+    # product. All shingles of the chunk go through numpy in one pass.
+    hashes = []
+    offsets = []
+    for shingles in shingle_sets:
+        offsets.append(len(hashes))
+        hashes.extend(map(zlib.crc32, map(str.encode, shingles)))
+    x = np.asarray(hashes, dtype=np.uint64)
+    values = (_A[:, None] * x[None, :] + _B[:, None]) % _PRIME
+    return np.minimum.reduceat(values, offsets, axis=1).T.astype(np.uint32)
+
+
+def _band_keys(signatures: np.ndarray) -> np.ndarray:
+    # One signed 64-bit bucket key per band, (n, BANDS)
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    keys = (bands * _BAND_MIX[None, :, :]).sum(axis=2)  # wraps mod 2**64
+    return keys.view(np.int64)
+
+
+def _similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def _get_similarity() -> float:
+    return float(repo.get_setting(SIMILARITY_KEY, str(DEFAULT_SIMILARITY)) or DEFAULT_SIMILARITY)
+
+
+def _iter_chunks(rows: Iterable[Tuple[int, str, str]]) -> Iterable[Tuple[List[int], List[Tuple[int, int]], np.ndarray]]:
+    # (ids, (text hash, numbers hash) pairs, signatures) per chunk; products
+    # without any words are skipped
+    ids: List[int] = []
+    hashes: List[Tuple[int, int]] = []
+    shingle_sets: List[Set[str]] = []
+    for product_id, title, description in rows:
+        shingles = _shingles(title, description)
+        if not shingles:
+            continue
+        ids.append(product_id)
+        hashes.append((_text_hash(title, description), _numbers_hash(title)))
+        shingle_sets.append(shingles)
+        if len(ids) >= CHUNK_SIZE:
+            yield ids, hashes, _signatures(shingle_sets)
+            ids, hashes, shingle_sets = [], [], []
+    if ids:
+        yield ids, hashes, _signatures(shingle_sets)
+
+
+def _insert_index(conn, ids: Sequence[int], hashes: Sequence[Tuple[int, int]], signatures: np.ndarray) -> None:
+    conn.executemany(
+        "INSERT OR REPLACE INTO product_minhash (product_id, text_hash, numbers_hash, signature) VALUES (?,?,?,?)",
+        (
+            (pid, text_hash, numbers_hash, sig.tobytes())
+            for pid, (text_hash, numbers_hash), sig in zip(ids, hashes, signatures)
+        ),
+    )
+    _insert_buckets(conn, np.asarray(ids, dtype=np.int64), _band_keys(signatures))
+
+
+def _insert_buckets(conn, ids: np.ndarray, keys: np.ndarray) -> None:
+    # Band by band in primary key order, which keeps the b-tree appends cheap
+    for band in range(BANDS):
+        order = np.lexsort((ids, keys[:, band]))
+        conn.executemany(
+            "INSERT OR IGNORE INTO product_lsh_buckets (band, bucket, product_id) VALUES (?,?,?)",
+            ((band, key, pid) for key, pid in zip(keys[order, band].tolist(), ids[order].tolist())),
+        )
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[int, int] = {}
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        root = x
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while x != root:
+            parent[x], x = root, parent.get(x, x)
+        return root
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # The smaller id (the older product) becomes the root
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def _iter_buckets(conn, band: int) -> Iterable[List[int]]:
+    # Product ids of each shared bucket of a band, streamed in primary key order
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute("SELECT bucket, product_id FROM product_lsh_buckets WHERE band = ? ORDER BY bucket, product_id", (band,))
+    bucket = None
+    members: List[int] = []
+    for key, product_id in cur:
+        if key != bucket:
+            if len(members) > 1:
+                yield members
+            bucket, members = key, []
+        members.append(product_id)
+    if len(members) > 1:
+        yield members
+
+
+def _load_signatures(conn, product_ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    # (numbers hashes, signatures) in the order of product_ids
+    found: Dict[int, Tuple[int, bytes]] = {}
+    for i in range(0, len(product_ids), 500):
+        chunk = product_ids[i:i + 500]
+        cur = conn.execute(
+            f"SELECT product_id, numbers_hash, signature FROM product_minhash WHERE product_id IN ({','.join('?' for _ in chunk)})",
+            chunk,
+        )
+        for pid, numbers_hash, signature in cur:
+            found[pid] = (numbers_hash, signature)
+    numbers = np.asarray([found[pid][0] for pid in product_ids], dtype=np.int64)
+    signatures = np.frombuffer(b"".join(found[pid][1] for pid in product_ids), dtype=np.uint32)
+    return numbers, signatures.reshape(len(product_ids), NUM_PERM)
+
+
+def rebuild_duplicate_groups() -> Dict[str, int]:
+    # Full rebuild: signatures and buckets for every product, a chunk at a
+    # time, then candidate pairs from walking each band's stored buckets in
+    # key order. Memory is bounded by the chunk and the largest bucket, not by
+    # the catalog, and there is no pairwise comparison of products.
+    conn = get_connection()
+    threshold = _get_similarity()
+    conn.execute("DELETE FROM product_minhash")
+    conn.execute("DELETE FROM product_lsh_buckets")
+    conn.execute("DELETE FROM product_groups")
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(f"SELECT id, title, substr(description, 1, {DESCRIPTION_CHARS}) FROM products ORDER BY id")
+    products = 0
+    max_id = 0
+    for ids, hashes, signatures in _iter_chunks(cur):
+        _insert_index(conn, ids, hashes, signatures)
+        products += len(ids)
+        max_id = ids[-1]
+    if not products:
+        conn.commit()
+        return {"products": 0, "groups": 0, "duplicates": 0}
+
+    groups = _UnionFind()
+    min_equal = int(np.ceil(threshold * NUM_PERM - 1e-9))
+    for band in range(BANDS):
+        for member_ids in _iter_buckets(conn, band):
+            # Near-duplicates share most bands, so later bands mostly find
+            # buckets that are already one group
+            root = groups.find(member_ids[0])
+            if all(groups.find(pid) == root for pid in member_ids[1:]):
+                continue
+            # The whole bucket in one numpy pass: its first members against
+            # all members, upper triangle only
+            numbers, signatures = _load_signatures(conn, member_ids)
+            head = slice(0, MAX_BUCKET_PAIRS)
+            equal = (signatures[head][:, None, :] == signatures[None, :, :]).sum(axis=2)
+            similar = (equal >= min_equal) & (numbers[head][:, None] == numbers[None, :])
+            for i, j in zip(*np.nonzero(np.triu(similar, k=1))):
+                groups.union(member_ids[i], member_ids[j])
+
+    members_by_root: Dict[int, List[int]] = {}
+    for row in list(groups.parent):
+        members_by_root.setdefault(groups.find(row), []).append(row)
+    rows = []
+    for root, members in members_by_root.items():
+        rows.append((root, root))
+        rows.extend((member, root) for member in members if member != root)
+    conn.executemany("INSERT INTO product_groups (product_id, canonical_id) VALUES (?,?)", rows)
+    repo.set_setting(WATERMARK_KEY, str(max_id), commit=False)
+    conn.commit()
+    return {"products": products, "groups": len(members_by_root), "duplicates": len(rows) - len(members_by_root)}
+
+
+def _merge(conn, product_ids: Set[int]) -> None:
+    # Puts the products, and every group they already belong to, under the
+    # smallest id among them
+    canonical_ids = set(product_ids)
+    placeholders = ",".join("?" for _ in product_ids)
+    for (canonical_id,) in conn.execute(
+        f"SELECT DISTINCT canonical_id FROM product_groups WHERE product_id IN ({placeholders})",
+        list(product_ids),
+    ):
+        canonical_ids.add(canonical_id)
+    target = min(canonical_ids)
+    placeholders = ",".join("?" for _ in canonical_ids)
+    conn.execute(
+        f"UPDATE product_groups SET canonical_id = ? WHERE canonical_id IN ({placeholders})",
+        [target, *canonical_ids],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO product_groups (product_id, canonical_id) VALUES (?,?)",
+        [(pid, target) for pid in product_ids | {target}],
+    )
+
+
+def _remove_buckets(conn, product_id: int, signature: bytes) -> None:
+    # Bucket rows are keyed by (band, bucket), so recompute the product's keys
+    # from its stored signature to find them
+    keys = _band_keys(np.frombuffer(signature, dtype=np.uint32)[None, :])[0]
+    conn.executemany(
+        "DELETE FROM product_lsh_buckets WHERE band = ? AND bucket = ? AND product_id = ?",
+        [(band, int(key), product_id) for band, key in enumerate(keys)],
+    )
+
+
+def remove_product(product_id: int, commit: bool = True) -> None:
+    # Drops a deleted product from the index and from its duplicate group
+    conn = get_connection()
+    row = conn.execute("SELECT signature FROM product_minhash WHERE product_id = ?", (product_id,)).fetchone()
+    if row is not None:
+        _remove_buckets(conn, product_id, row[0])
+        conn.execute("DELETE FROM product_minhash WHERE product_id = ?", (product_id,))
+    repo.leave_duplicate_group(product_id, commit=False)
+    if commit:
+        conn.commit()
+
+
+def _candidates(conn, product_id: int, keys: Sequence[int]) -> List[int]:
+    # Spelled out as ORs: SQLite turns them into one primary key search per
+    # band, where a row-value IN (VALUES ...) would scan the whole table
+    where = " OR ".join("(band = ? AND bucket = ?)" for _ in keys)
+    params: List[int] = []
+    for band, key in enumerate(keys):
+        params.extend((band, key))
+    cur = conn.execute(f"SELECT DISTINCT product_id FROM product_lsh_buckets WHERE {where}", params)
+    return [pid for (pid,) in cur if pid != product_id]
+
+
+def update_duplicate_groups(product_ids: Optional[Sequence[int]] = None) -> Dict[str, int]:
+    # Incremental update after an import. Defaults to products added since the
+    # last run; imports pass the ids they touched. Products whose title and
+    # description are unchanged are skipped using the stored text hash.
+    conn = get_connection()
+    threshold = _get_similarity()
+    watermark = int(repo.get_setting(WATERMARK_KEY, "0") or 0)
+    if product_ids is None:
+        cur = conn.execute(
+            f"SELECT id, title, substr(description, 1, {DESCRIPTION_CHARS}) FROM products WHERE id > ? ORDER BY id", (watermark,)
+        )
+        rows = [tuple(r) for r in cur]
+    else:
+        rows = []
+        ids = list(product_ids)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cur = conn.execute(
+                f"SELECT id, title, substr(description, 1, {DESCRIPTION_CHARS}) FROM products WHERE id IN ({','.join('?' for _ in chunk)})",
+                chunk,
+            )
+            rows.extend(tuple(r) for r in cur)
+    if not rows:
+        return {"indexed": 0, "matched": 0}
+
+    known: Dict[int, Tuple[int, bytes]] = {}
+    row_ids = [r[0] for r in rows]
+    for i in range(0, len(row_ids), 500):
+        chunk = row_ids[i:i + 500]
+        cur = conn.execute(
+            f"SELECT product_id, text_hash, signature FROM product_minhash WHERE product_id IN ({','.join('?' for _ in chunk)})",
+            chunk,
+        )
+        for pid, text_hash, signature in cur:
+            known[pid] = (text_hash, signature)
+    changed = [r for r in rows if r[0] not in known or known[r[0]][0] != _text_hash(r[1], r[2])]
+
+    indexed = 0
+    matched = 0
+    for ids, hashes, signatures in _iter_chunks(changed):
+        # Drop the old buckets and group membership of re-indexed products
+        for pid in ids:
+            if pid in known:
+                _remove_buckets(conn, pid, known[pid][1])
+                repo.leave_duplicate_group(pid, commit=False)
+        _insert_index(conn, ids, hashes, signatures)
+        keys = _band_keys(signatures).tolist()
+        for pid, (_, numbers_hash), signature, product_keys in zip(ids, hashes, signatures, keys):
+            candidates = _candidates(conn, pid, product_keys)
+            if not candidates:
+                continue
+            placeholders = ",".join("?" for _ in candidates)
+            cur = conn.execute(
+                f"SELECT product_id, signature FROM product_minhash WHERE product_id IN ({placeholders}) AND numbers_hash = ?",
+                [*candidates, numbers_hash],
+            )
+            duplicates = {
+                other for other, other_signature in cur
+                if _similarity(signature, np.frombuffer(other_signature, dtype=np.uint32)) >= threshold
+            }
+            if duplicates:
+                _merge(conn, duplicates | {pid})
+                matched += 1
+        indexed += len(ids)
+    if product_ids is None:
+        repo.set_setting(WATERMARK_KEY, str(max(r[0] for r in rows)), commit=False)
+    conn.commit()
+    return {"indexed": indexed, "matched": matched}
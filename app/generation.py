@@ -0,0 +1,287 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import openai
+
+from .database import get_connection
+from .utils import slugify, utc_now_iso
+from . import repositories as repo
+
+
+DEFAULT_MODEL = "gpt-4o-mini"
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_TOKENS_PER_MINUTE = 90000
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BATCH_SIZE = 20
+MAX_ATTEMPTS = 5
+
+PRODUCT_SYSTEM_PROMPT = (
+    "You write concise, persuasive e-commerce product descriptions. "
+    "Reply with the description only, 2-3 short paragraphs, no headings."
+)
+BLOG_SYSTEM_PROMPT = (
+    "You write helpful, SEO-friendly blog posts for an affiliate shop. "
+    "Reply in Markdown without a top-level title."
+)
+
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class RateLimiter:
+    # Two token buckets (requests and tokens per minute) refilled continuously.
+    # acquire() waits until both have room for the request.
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.request_capacity = float(requests_per_minute)
+        self.token_capacity = float(tokens_per_minute)
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.request_capacity, self.requests + elapsed * self.request_capacity / 60)
+        self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_capacity / 60)
+
+    async def acquire(self, tokens: int) -> None:
+        tokens = min(float(tokens), self.token_capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait_requests = (1 - self.requests) * 60 / self.request_capacity
+                wait_tokens = (tokens - self.tokens) * 60 / self.token_capacity
+                await asyncio.sleep(max(wait_requests, wait_tokens, 0.01))
+
+
+def _prompt_hash(model: str, system: str, prompt: str, max_tokens: int) -> str:
+    payload = json.dumps([model, system, prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_get(prompt_hash: str) -> Optional[str]:
+    row = get_connection().execute(
+        "SELECT response FROM llm_cache WHERE prompt_hash = ?", (prompt_hash,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def _cache_put(prompt_hash: str, model: str, response: str) -> None:
+    conn = get_connection()
+    conn.execute(
+        "INSERT OR REPLACE INTO llm_cache (prompt_hash, model, response, created_at) VALUES (?,?,?,?)",
+        (prompt_hash, model, response, utc_now_iso()),
+    )
+    conn.commit()
+
+
+def _estimate_tokens(system: str, prompt: str, max_tokens: int) -> int:
+    # ~4 characters per token is close enough for rate limiting
+    return (len(system) + len(prompt)) // 4 + max_tokens
+
+
+def get_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> openai.AsyncOpenAI:
+    base_url = base_url or repo.get_setting("llm_base_url") or None
+    # The key only ever comes from the environment, never from settings: they
+    # are readable from Admin and copied into the public snapshot
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        if not base_url:
+            raise ValueError("No LLM API key configured (set OPENAI_API_KEY)")
+        api_key = "unused"  # local and mock servers usually ignore it
+    # Retries are handled here, under the rate limiter
+    return openai.AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+
+
+class _Generator:
+    def __init__(
+        self,
+        client: openai.AsyncOpenAI,
+        model: str,
+        limiter: RateLimiter,
+        concurrency: int,
+        max_tokens: int,
+    ):
+        self.client = client
+        self.model = model
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_tokens = max_tokens
+        self.stats = {"cached": 0, "generated": 0, "failed": 0}
+
+    async def complete(self, system: str, prompt: str) -> Optional[str]:
+        prompt_hash = _prompt_hash(self.model, system, prompt, self.max_tokens)
+        cached = _cache_get(prompt_hash)
+        if cached is not None:
+            self.stats["cached"] += 1
+            return cached
+        async with self.semaphore:
+            for attempt in range(MAX_ATTEMPTS):
+                await self.limiter.acquire(_estimate_tokens(system, prompt, self.max_tokens))
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": system},
+                            {"role": "user", "content": prompt},
+                        ],
+                        max_tokens=self.max_tokens,
+                    )
+                except _RETRYABLE_ERRORS:
+                    if attempt == MAX_ATTEMPTS - 1:
+                        self.stats["failed"] += 1
+                        return None
+                    await asyncio.sleep(min(30.0, 2 ** attempt) + random.uniform(0, 1))
+                    continue
+                text = (response.choices[0].message.content or "").strip()
+                if not text:
+                    self.stats["failed"] += 1
+                    return None
+                # Cached immediately so a failure later in the run never costs this call again
+                _cache_put(prompt_hash, self.model, text)
+                self.stats["generated"] += 1
+                return text
+        return None
+
+
+def _make_generator(
+    model: Optional[str],
+    base_url: Optional[str],
+    concurrency: Optional[int],
+    max_tokens: int,
+) -> _Generator:
+    # Called inside the event loop so the lock and semaphore belong to it
+    requests_per_minute = int(repo.get_setting("llm_requests_per_minute", str(DEFAULT_REQUESTS_PER_MINUTE)) or DEFAULT_REQUESTS_PER_MINUTE)
+    tokens_per_minute = int(repo.get_setting("llm_tokens_per_minute", str(DEFAULT_TOKENS_PER_MINUTE)) or DEFAULT_TOKENS_PER_MINUTE)
+    return _Generator(
+        client=get_client(base_url),
+        model=model or repo.get_setting("llm_model", DEFAULT_MODEL) or DEFAULT_MODEL,
+        limiter=RateLimiter(requests_per_minute, tokens_per_minute),
+        concurrency=concurrency or DEFAULT_CONCURRENCY,
+        max_tokens=max_tokens,
+    )
+
+
+async def _run_batched(
+    generator_args: Tuple,
+    jobs: Sequence[Tuple[Any, str, str]],
+    write,
+    batch_size: int,
+) -> Dict[str, int]:
+    # jobs are (key, system, prompt); results are written and committed batch_size at a time
+    generator = _make_generator(*generator_args)
+
+    async def run(key, system, prompt):
+        return key, await generator.complete(system, prompt)
+
+    conn = get_connection()
+    written = 0
+    pending: List[Tuple[Any, str]] = []
+
+    def flush() -> None:
+        for item in pending:
+            write(*item)
+        conn.commit()
+        pending.clear()
+
+    try:
+        for next_result in asyncio.as_completed([run(*job) for job in jobs]):
+            key, text = await next_result
+            if text is None:
+                continue
+            pending.append((key, text))
+            written += 1
+            if len(pending) >= batch_size:
+                flush()
+        flush()
+    finally:
+        await generator.client.close()
+    return dict(generator.stats, written=written)
+
+
+def _product_prompt(product) -> str:
+    parts = [f"Product: {product['title']}"]
+    if product["category_name"]:
+        parts.append(f"Category: {product['category_name']}")
+    parts.append(f"Price: {product['price']:.2f} {product['currency']}")
+    # Deliberately excludes the current description so a rerun hits the cache
+    return "\n".join(parts)
+
+
+def generate_product_descriptions(
+    product_ids: Optional[Sequence[int]] = None,
+    model: Optional[str] = None,
+    base_url: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_tokens: int = 400,
+) -> Dict[str, int]:
+    # Defaults to every product that has no description yet
+    if product_ids is None:
+        products = repo.list_products_without_description()
+    else:
+        products = [p for p in (repo.get_product_by_id(pid) for pid in product_ids) if p]
+    by_id = {p["id"]: p for p in products}
+
+    def write(product_id: int, text: str) -> None:
+        p = by_id[product_id]
+        repo.update_product(
+            p["id"],
+            title=p["title"],
+            description=text,
+            price=p["price"],
+            currency=p["currency"],
+            image_url=p["image_url"],
+            category_name=p["category_name"],
+            affiliate_url_template=p["affiliate_url_template"],
+            active=bool(p["active"]),
+            commit=False,
+        )
+
+    jobs = [(p["id"], PRODUCT_SYSTEM_PROMPT, _product_prompt(p)) for p in products]
+    return asyncio.run(_run_batched((model, base_url, concurrency, max_tokens), jobs, write, batch_size))
+
+
+def generate_blog_posts(
+    topics: Sequence[str],
+    status: str = "draft",
+    model: Optional[str] = None,
+    base_url: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_tokens: int = 1200,
+) -> Dict[str, int]:
+    # Topics become post titles. Posts are unique by slug, so topics whose slug
+    # is empty, repeats an earlier topic or already has a post are skipped.
+    titles = []
+    slugs = set()
+    for topic in topics:
+        topic = topic.strip()
+        slug_value = slugify(topic)
+        if slug_value and slug_value not in slugs and not repo.get_blog_post_by_slug(slug_value):
+            slugs.add(slug_value)
+            titles.append(topic)
+
+    def write(title: str, text: str) -> None:
+        # Checked again: a post may have been created while this one was generating
+        if not repo.get_blog_post_by_slug(slugify(title)):
+            repo.create_blog_post(title, text, status, commit=False)
+
+    jobs = [(title, BLOG_SYSTEM_PROMPT, f"Write a blog post titled: {title}") for title in titles]
+    return asyncio.run(_run_batched((model, base_url, concurrency, max_tokens), jobs, write, batch_size))
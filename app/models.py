@@ -0,0 +1,80 @@
+from collections import namedtuple
+from typing import Dict, Tuple
+
+
+# Records are tuple subclasses with no per-instance __dict__. They also accept
+# string keys (product["title"]) so they stay drop-in compatible with the
+# sqlite3.Row objects the pages were written against.
+
+
+class _Record:
+    __slots__ = ()
+    _fields: Tuple[str, ...]
+    _index: Dict[str, int]
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._index = {name: i for i, name in enumerate(cls._fields)}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._fields
+
+
+class User(_Record, namedtuple("User", "id username password_hash is_admin created_at")):
+    __slots__ = ()
+
+
+class UserListItem(_Record, namedtuple("UserListItem", "id username is_admin created_at")):
+    __slots__ = ()
+
+
+class Category(_Record, namedtuple("Category", "id name slug")):
+    __slots__ = ()
+
+
+class Product(_Record, namedtuple(
+    "Product",
+    "id title slug description price currency image_url category_id "
+    "affiliate_url_template active created_at category_name category_slug",
+)):
+    __slots__ = ()
+
+
+class ProductListItem(_Record, namedtuple(
+    "ProductListItem",
+    "id title slug excerpt price currency image_url affiliate_url_template "
+    "active category_name category_slug",
+)):
+    __slots__ = ()
+
+
+class PriceDrop(_Record, namedtuple(
+    "PriceDrop",
+    "id title slug image_url currency previous_price price drop_pct",
+)):
+    __slots__ = ()
+
+
+class BlogPost(_Record, namedtuple("BlogPost", "id title slug content_md status created_at updated_at")):
+    __slots__ = ()
+
+
+class BlogPostListItem(_Record, namedtuple("BlogPostListItem", "id title slug excerpt status created_at")):
+    __slots__ = ()
+
+
+class Affiliate(_Record, namedtuple("Affiliate", "id name code created_at")):
+    __slots__ = ()
+
+
+class Order(_Record, namedtuple("Order", "id product_id affiliate_id price currency status created_at")):
+    __slots__ = ()
+
+
+class Click(_Record, namedtuple("Click", "id product_id affiliate_id referrer created_at")):
+    __slots__ = ()
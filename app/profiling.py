@@ -0,0 +1,204 @@
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .settings import get_profile_dir
+from . import repositories as repo
+
+
+DEFAULT_KEEP = 20
+QUERY_PARAM = "profile"
+TOP_FUNCTIONS = 30
+_MAX_TREE_DEPTH = 24
+_MIN_TREE_SHARE = 0.005  # nodes under 0.5% of the run are dropped from the tree
+_FLAGS_TTL_SECONDS = 5.0
+
+# Where a function's own time is booked. Builtins (C functions) have no file
+# and take the category of the code that calls them most.
+_DB_MARKERS = (
+    "sqlite3",
+    os.path.join("app", "repositories.py"),
+    os.path.join("app", "database.py"),
+    os.path.join("app", "models.py"),
+)
+_RENDERING_MARKERS = tuple(os.sep + name + os.sep for name in ("streamlit", "protobuf", "PIL", "pyarrow"))
+
+_flags: Tuple[float, bool, str] = (0.0, False, "")
+
+
+def _profiling_flags() -> Tuple[bool, str]:
+    # (enabled for every rerun, admin token). Cached for a few seconds so a
+    # disabled profiler costs one tuple lookup per rerun.
+    global _flags
+    expires, enabled, token = _flags
+    now = time.monotonic()
+    if now >= expires:
+        enabled = (repo.get_setting("profiling_enabled", "0") or "0") == "1"
+        token = repo.get_setting("profiling_token", "") or ""
+        _flags = (now + _FLAGS_TTL_SECONDS, enabled, token)
+    return enabled, token
+
+
+def _requested(query_params: Optional[Dict[str, List[str]]]) -> bool:
+    enabled, token = _profiling_flags()
+    if enabled:
+        return True
+    if not token or not query_params:
+        return False
+    supplied = (query_params.get(QUERY_PARAM) or [""])[0]
+    return bool(supplied) and hmac.compare_digest(supplied, token)
+
+
+@contextmanager
+def profile_page(page: str, query_params: Optional[Dict[str, List[str]]] = None) -> Iterator[None]:
+    # Wraps a page body. Profiles the rerun when profiling is switched on in
+    # settings, or when the URL carries ?profile=<admin token>.
+    if not _requested(query_params):
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is active (Python 3.12+ allows only one at a time)
+        yield
+        return
+    started = time.perf_counter()
+    outcome = "completed"
+    try:
+        yield
+    except BaseException as e:
+        # st.stop() and reruns end a page by raising; keep the profile anyway
+        outcome = type(e).__name__
+        raise
+    finally:
+        profiler.disable()
+        wall = time.perf_counter() - started
+        _save_profile(page, outcome, wall, profiler)
+
+
+def _label(func: Tuple[str, int, str]) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+
+def _categorize(stats: Dict) -> Dict[Tuple[str, int, str], str]:
+    categories: Dict[Tuple[str, int, str], str] = {}
+
+    def by_path(func: Tuple[str, int, str]) -> Optional[str]:
+        filename, _, name = func
+        text = name if filename == "~" else filename
+        if any(marker in text for marker in _DB_MARKERS):
+            return "db"
+        if filename != "~" and any(marker in filename for marker in _RENDERING_MARKERS):
+            return "rendering"
+        if filename == "~":
+            return None
+        return "python"
+
+    for func in stats:
+        categories[func] = by_path(func)
+    for func, (_, _, _, _, callers) in stats.items():
+        if categories[func] is None:
+            caller = max(callers.items(), key=lambda c: c[1][3], default=None)
+            categories[func] = (categories.get(caller[0]) if caller else None) or "python"
+    return categories
+
+
+def _build_tree(stats: Dict, total: float) -> Dict[str, Any]:
+    # cProfile records a single level of caller context, so time below the
+    # first level is apportioned by each caller's share of the callee; good
+    # enough to see where a rerun goes, not an exact stack profile.
+    callees: Dict[Tuple[str, int, str], List[Tuple[Tuple[str, int, str], float]]] = {}
+    roots = []
+    for func, (_, _, _, cumtime, callers) in stats.items():
+        known = [caller for caller in callers if caller in stats]
+        if not known:
+            roots.append((func, cumtime))
+        for caller in known:
+            callees.setdefault(caller, []).append((func, callers[caller][3]))
+    min_time = total * _MIN_TREE_SHARE
+
+    def node(func, spent: float, depth: int, path: frozenset) -> Dict[str, Any]:
+        children = []
+        func_total = stats[func][3] or 1.0
+        if depth < _MAX_TREE_DEPTH:
+            for child, edge_time in sorted(callees.get(func, []), key=lambda c: -c[1]):
+                child_time = edge_time * min(1.0, spent / func_total)
+                if child_time < min_time:
+                    break
+                if child not in path:
+                    children.append(node(child, child_time, depth + 1, path | {child}))
+        return {"name": _label(func), "time": spent, "children": children}
+
+    roots.sort(key=lambda r: -r[1])
+    return {
+        "name": "rerun",
+        "time": total,
+        "children": [node(func, spent, 1, frozenset([func])) for func, spent in roots if spent >= min_time],
+    }
+
+
+def _save_profile(page: str, outcome: str, wall: float, profiler: cProfile.Profile) -> None:
+    stats = pstats.Stats(profiler).stats  # type: ignore[attr-defined]
+    categories = _categorize(stats)
+    breakdown = {"db": 0.0, "rendering": 0.0, "python": 0.0}
+    for func, (_, _, tottime, _, _) in stats.items():
+        breakdown[categories[func]] += tottime
+    profiled = sum(breakdown.values())
+    top = sorted(stats.items(), key=lambda s: -s[1][2])[:TOP_FUNCTIONS]
+    now = datetime.now(timezone.utc)
+    profile = {
+        "page": page,
+        "created_at": now.isoformat(),
+        "outcome": outcome,
+        "wall_seconds": wall,
+        "profiled_seconds": profiled,
+        "breakdown": breakdown,
+        "top": [
+            {
+                "name": _label(func),
+                "category": categories[func],
+                "calls": ncalls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            }
+            for func, (_, ncalls, tottime, cumtime, _) in top
+        ],
+        "tree": _build_tree(stats, profiled),
+    }
+    profile_dir = get_profile_dir()
+    name = f"{now.strftime('%Y%m%dT%H%M%S%f')}-{page}.json"
+    tmp_path = os.path.join(profile_dir, name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f)
+    os.replace(tmp_path, os.path.join(profile_dir, name))
+    _prune(profile_dir)
+
+
+def _prune(profile_dir: str) -> None:
+    keep = int(repo.get_setting("profiling_keep", str(DEFAULT_KEEP)) or DEFAULT_KEEP)
+    for name in list_profiles()[keep:]:
+        try:
+            os.remove(os.path.join(profile_dir, name))
+        except FileNotFoundError:
+            pass  # pruned concurrently by another session
+
+
+def list_profiles() -> List[str]:
+    # Newest first
+    names = [n for n in os.listdir(get_profile_dir()) if n.endswith(".json")]
+    return sorted(names, reverse=True)
+
+
+def load_profile(name: str) -> Dict[str, Any]:
+    with open(os.path.join(get_profile_dir(), os.path.basename(name)), "r", encoding="utf-8") as f:
+        return json.load(f)
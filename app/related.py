@@ -0,0 +1,302 @@
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from .database import get_connection
+from .settings import get_related_dir
+from . import repositories as repo
+
+
+WATERMARK_KEY = "related_products_watermark"
+DEFAULT_TOP_K = 8
+DEFAULT_BLOCK_SIZE = 512
+# Terms in more than this share of products (e.g. "the", a catch-all category)
+# say nothing about relatedness and make the similarity blocks dense.
+DEFAULT_MAX_DF = 0.5
+
+_INSERT_SQL = "INSERT INTO related_products (product_id, rank, related_product_id, score) VALUES (?,?,?,?)"
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_matrix = None  # per-worker copy of the normalized TF-IDF matrix
+
+
+def _iter_documents(conn, product_ids: Optional[Sequence[int]] = None) -> Iterable[Tuple[int, List[str]]]:
+    # Active products only; all of them, or those of product_ids
+    sql = (
+        "SELECT p.id, p.title, p.description, c.slug FROM products p "
+        "LEFT JOIN categories c ON p.category_id = c.id WHERE p.active = 1"
+    )
+    if product_ids is None:
+        chunks: List[List[int]] = [[]]
+    else:
+        ids = sorted(set(product_ids))
+        chunks = [ids[i:i + 500] for i in range(0, len(ids), 500)]
+    for chunk in chunks:
+        cur = conn.cursor()
+        cur.row_factory = None
+        if product_ids is None:
+            cur.execute(sql + " ORDER BY p.id")
+        else:
+            cur.execute(sql + f" AND p.id IN ({','.join('?' for _ in chunk)}) ORDER BY p.id", chunk)
+        for product_id, title, description, category_slug in cur:
+            title_tokens = _TOKEN_RE.findall((title or "").lower())
+            # Title terms count double; the category is a single token of its own
+            tokens = title_tokens + title_tokens + _TOKEN_RE.findall((description or "").lower())
+            if category_slug:
+                tokens.append("category:" + category_slug)
+            yield product_id, tokens
+
+
+def _count_matrix(
+    documents: Iterable[Tuple[int, List[str]]], vocabulary: Dict[str, int], grow: bool
+) -> Tuple[np.ndarray, sp.csr_matrix]:
+    # Term counts per product. With grow=False, terms outside the vocabulary are dropped.
+    ids: List[int] = []
+    indices: List[int] = []
+    indptr = [0]
+    for product_id, tokens in documents:
+        ids.append(product_id)
+        for token in tokens:
+            column = vocabulary.setdefault(token, len(vocabulary)) if grow else vocabulary.get(token)
+            if column is not None:
+                indices.append(column)
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float32)
+    counts = sp.csr_matrix(
+        (data, np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(ids), len(vocabulary)),
+    )
+    counts.sum_duplicates()
+    return np.asarray(ids, dtype=np.int64), counts
+
+
+def _weight(counts: sp.csr_matrix, idf: np.ndarray) -> sp.csr_matrix:
+    counts.data = 1 + np.log(counts.data)  # sublinear tf
+    matrix = (counts @ sp.diags(idf)).tocsr()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sp.diags(1 / norms) @ matrix).tocsr().astype(np.float32)
+
+
+def build_tfidf(
+    documents: Iterable[Tuple[int, List[str]]], max_df: float = DEFAULT_MAX_DF
+) -> Tuple[np.ndarray, sp.csr_matrix, List[str], np.ndarray]:
+    # (product ids, L2-normalized TF-IDF rows, kept terms by column, idf by column)
+    vocabulary: Dict[str, int] = {}
+    ids, counts = _count_matrix(documents, vocabulary, grow=True)
+    n_docs = len(ids)
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    keep = np.flatnonzero(df <= max(1, max_df * n_docs))
+    idf = (np.log((1 + n_docs) / (1 + df[keep])) + 1).astype(np.float32)
+    terms_by_column = np.empty(len(vocabulary), dtype=object)
+    for term, column in vocabulary.items():
+        terms_by_column[column] = term
+    return ids, _weight(counts[:, keep], idf), list(terms_by_column[keep]), idf
+
+
+def _model_path() -> str:
+    return os.path.join(get_related_dir(), "model.npz")
+
+
+def _save_model(ids: np.ndarray, matrix: sp.csr_matrix, terms: List[str], idf: np.ndarray) -> None:
+    # Kept by the full rebuild so incremental updates can vectorize new products
+    # with the same vocabulary and idf instead of re-reading the whole catalog.
+    # Terms never contain a newline, so they are stored as one joined blob.
+    path = _model_path()
+    tmp_path = path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        ids=ids,
+        data=matrix.data,
+        indices=matrix.indices,
+        indptr=matrix.indptr,
+        idf=idf,
+        terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+    )
+    os.replace(tmp_path, path)
+
+
+def _load_model() -> Optional[Tuple[np.ndarray, sp.csr_matrix, List[str], np.ndarray]]:
+    try:
+        with np.load(_model_path()) as f:
+            idf = f["idf"]
+            terms = f["terms"].tobytes().decode("utf-8").split("\n") if len(idf) else []
+            matrix = sp.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=(len(f["ids"]), len(idf)))
+            return f["ids"], matrix, terms, idf
+    except FileNotFoundError:
+        return None
+
+
+def _init_worker(matrix: sp.csr_matrix) -> None:
+    global _matrix
+    _matrix = matrix
+
+
+def _top_k_block(rows: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # Cosine similarity of a block of rows against every product; vectors are
+    # L2-normalized so this is a sparse dot product. Only the block result is
+    # ever materialized, which keeps memory bounded by the block size.
+    sims = (_matrix[rows] @ _matrix.T).tocsr()
+    result = []
+    for i, row in enumerate(rows):
+        start, end = sims.indptr[i], sims.indptr[i + 1]
+        cols = sims.indices[start:end]
+        scores = sims.data[start:end]
+        mask = cols != row
+        cols, scores = cols[mask], scores[mask]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+            cols, scores = cols[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        result.append((cols[order], scores[order]))
+    return result
+
+
+def _compute_neighbours(
+    matrix: sp.csr_matrix,
+    rows: np.ndarray,
+    k: int,
+    block_size: int,
+    workers: int,
+) -> Iterable[Tuple[int, np.ndarray, np.ndarray]]:
+    blocks = [rows[i:i + block_size] for i in range(0, len(rows), block_size)]
+    if workers <= 1:
+        _init_worker(matrix)
+        results = map(_top_k_block, blocks, [k] * len(blocks))
+        for block, block_result in zip(blocks, results):
+            for row, (cols, scores) in zip(block, block_result):
+                yield int(row), cols, scores
+        return
+    # Spawned, not forked: this runs inside the multi-threaded Streamlit server,
+    # and a forked child can inherit locks held by other threads (sqlite,
+    # logging, Tornado) and deadlock on them
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(matrix,),
+    ) as pool:
+        for block, block_result in zip(blocks, pool.map(_top_k_block, blocks, [k] * len(blocks))):
+            for row, (cols, scores) in zip(block, block_result):
+                yield int(row), cols, scores
+
+
+def _write_lists(conn, lists: Dict[int, Sequence[Tuple[int, float]]]) -> None:
+    product_ids = list(lists)
+    for i in range(0, len(product_ids), 500):
+        chunk = product_ids[i:i + 500]
+        conn.execute(
+            f"DELETE FROM related_products WHERE product_id IN ({','.join('?' for _ in chunk)})",
+            chunk,
+        )
+    conn.executemany(
+        _INSERT_SQL,
+        (
+            (product_id, rank, related_id, float(score))
+            for product_id, entries in lists.items()
+            for rank, (related_id, score) in enumerate(entries)
+        ),
+    )
+
+
+def rebuild_related_products(
+    k: int = DEFAULT_TOP_K,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    workers: Optional[int] = None,
+) -> int:
+    conn = get_connection()
+    ids, matrix, terms, idf = build_tfidf(_iter_documents(conn))
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+    conn.execute("DELETE FROM related_products")
+    batch: List[Tuple[int, int, int, float]] = []
+    for row, cols, scores in _compute_neighbours(matrix, np.arange(len(ids)), k, block_size, workers):
+        product_id = int(ids[row])
+        batch.extend(
+            (product_id, rank, int(ids[col]), float(score))
+            for rank, (col, score) in enumerate(zip(cols, scores))
+        )
+        if len(batch) >= 50000:
+            conn.executemany(_INSERT_SQL, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(_INSERT_SQL, batch)
+    repo.set_setting(WATERMARK_KEY, str(int(ids.max()) if len(ids) else 0), commit=False)
+    conn.commit()
+    _save_model(ids, matrix, terms, idf)
+    return len(ids)
+
+
+def update_related_products(
+    product_ids: Optional[Sequence[int]] = None,
+    k: int = DEFAULT_TOP_K,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> int:
+    # Incremental refresh after an import. Defaults to products added since the
+    # last run. Only these products are tokenized, with the vocabulary and idf
+    # of the last full rebuild (terms it never saw are ignored), and their rows
+    # replace any previous ones in the saved model. Their lists are computed
+    # against the whole catalog, and each one is also offered to its
+    # neighbours' lists, replacing their weakest entry when it scores higher.
+    # Other lists are patched rather than recomputed and the idf drifts as the
+    # catalog grows, so run rebuild_related_products now and then.
+    model = _load_model()
+    if model is None:
+        return rebuild_related_products(k=k, block_size=block_size)
+    conn = get_connection()
+    model_ids, model_matrix, terms, idf = model
+    if product_ids is None:
+        watermark = int(repo.get_setting(WATERMARK_KEY, "0") or 0)
+        product_ids = [r[0] for r in conn.execute("SELECT id FROM products WHERE id > ?", (watermark,))]
+    if not product_ids:
+        return 0
+    new_ids, counts = _count_matrix(
+        _iter_documents(conn, product_ids), {term: column for column, term in enumerate(terms)}, grow=False
+    )
+    # Drop replaced rows, and rows of products deleted or deactivated since
+    active_ids = np.fromiter((r[0] for r in conn.execute("SELECT id FROM products WHERE active = 1")), dtype=np.int64)
+    keep = np.flatnonzero(
+        np.isin(model_ids, active_ids) & ~np.isin(model_ids, np.asarray(product_ids, dtype=np.int64))
+    )
+    ids = np.concatenate([model_ids[keep], new_ids])
+    matrix = sp.vstack([model_matrix[keep], _weight(counts, idf)], format="csr")
+    rows = np.arange(len(keep), len(ids))
+    if len(rows) == 0:
+        _save_model(ids, matrix, terms, idf)
+        return 0
+
+    updated: Dict[int, List[Tuple[int, float]]] = {}
+    offers: Dict[int, List[Tuple[int, float]]] = {}
+    for row, cols, scores in _compute_neighbours(matrix, rows, k, block_size, workers=1):
+        product_id = int(ids[row])
+        updated[product_id] = [(int(ids[col]), float(score)) for col, score in zip(cols, scores)]
+        for related_id, score in updated[product_id]:
+            offers.setdefault(related_id, []).append((product_id, score))
+
+    neighbour_ids = [pid for pid in offers if pid not in updated]
+    existing: Dict[int, List[Tuple[int, float]]] = {pid: [] for pid in neighbour_ids}
+    for i in range(0, len(neighbour_ids), 500):
+        chunk = neighbour_ids[i:i + 500]
+        cur = conn.execute(
+            "SELECT product_id, related_product_id, score FROM related_products "
+            f"WHERE product_id IN ({','.join('?' for _ in chunk)}) ORDER BY product_id, rank",
+            chunk,
+        )
+        for product_id, related_id, score in cur:
+            existing[product_id].append((related_id, score))
+    for product_id, entries in existing.items():
+        merged = {related_id: score for related_id, score in entries}
+        for related_id, score in offers[product_id]:
+            merged[related_id] = max(score, merged.get(related_id, 0.0))
+        updated[product_id] = sorted(merged.items(), key=lambda e: -e[1])[:k]
+
+    _write_lists(conn, updated)
+    watermark = max(int(ids.max()), int(repo.get_setting(WATERMARK_KEY, "0") or 0))
+    repo.set_setting(WATERMARK_KEY, str(watermark), commit=False)
+    conn.commit()
+    _save_model(ids, matrix, terms, idf)
+    return len(rows)
@@ -1,10 +1,80 @@
 import sqlite3
-from typing import Any, Dict, List, Optional, Tuple
-
-from .database import get_connection
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+from .database import get_connection, get_read_connection
+from .models import (
+    Affiliate,
+    BlogPost,
+    BlogPostListItem,
+    Category,
+    PriceDrop,
+    Product,
+    ProductListItem,
+    User,
+    UserListItem,
+)
 from .utils import slugify, utc_now_iso
 
 
+def _read_connection(snapshot: bool) -> sqlite3.Connection:
+    # Public pages read from the published snapshot; admin and write paths use the primary
+    return get_read_connection() if snapshot else get_connection()
+
+
+def _projection(projections: Dict[str, Tuple[Type, str]], name: str) -> Tuple[Type, str]:
+    try:
+        return projections[name]
+    except KeyError:
+        raise ValueError(f"Unknown projection {name!r}, expected one of {sorted(projections)}")
+
+
+def _fetch_all(conn: sqlite3.Connection, record_type: Type, sql: str, params: Sequence[Any] = ()) -> List[Any]:
+    # Plain tuple rows straight into the record type, skipping sqlite3.Row
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(sql, tuple(params))
+    return list(map(record_type._make, cur))
+
+
+def _fetch_one(conn: sqlite3.Connection, record_type: Type, sql: str, params: Sequence[Any] = ()) -> Optional[Any]:
+    cur = conn.cursor()
+    cur.row_factory = None
+    row = cur.execute(sql, tuple(params)).fetchone()
+    return record_type._make(row) if row else None
+
+
+# Each projection selects exactly the record's fields, in order
+_USER_PROJECTIONS = {
+    "full": (User, "id, username, password_hash, is_admin, created_at"),
+    "list": (UserListItem, "id, username, is_admin, created_at"),
+}
+
+_CATEGORY_COLUMNS = "id, name, slug"
+
+_PRODUCT_PROJECTIONS = {
+    "full": (
+        Product,
+        "p.id, p.title, p.slug, p.description, p.price, p.currency, p.image_url, p.category_id, "
+        "p.affiliate_url_template, p.active, p.created_at, c.name AS category_name, c.slug AS category_slug",
+    ),
+    # Cards only show the first 160 characters; one more tells them whether to add an ellipsis
+    "list": (
+        ProductListItem,
+        "p.id, p.title, p.slug, substr(p.description, 1, 161) AS excerpt, p.price, p.currency, p.image_url, "
+        "p.affiliate_url_template, p.active, c.name AS category_name, c.slug AS category_slug",
+    ),
+}
+
+_BLOG_POST_PROJECTIONS = {
+    "full": (BlogPost, "id, title, slug, content_md, status, created_at, updated_at"),
+    # The blog index shows up to 240 characters of the first paragraph
+    "list": (BlogPostListItem, "id, title, slug, substr(content_md, 1, 241) AS excerpt, status, created_at"),
+}
+
+_AFFILIATE_COLUMNS = "id, name, code, created_at"
+
+
 # -------------------- Users --------------------
 
 def count_users() -> int:
@@ -14,16 +84,14 @@ def count_users() -> int:
     return int(row[0]) if row else 0
 
 
-def get_user_by_username(username: str) -> Optional[sqlite3.Row]:
-    conn = get_connection()
-    cur = conn.execute("SELECT * FROM users WHERE username = ?", (username,))
-    return cur.fetchone()
+def get_user_by_username(username: str) -> Optional[User]:
+    record_type, columns = _USER_PROJECTIONS["full"]
+    return _fetch_one(get_connection(), record_type, f"SELECT {columns} FROM users WHERE username = ?", (username,))
 
 
-def list_users() -> List[sqlite3.Row]:
-    conn = get_connection()
-    cur = conn.execute("SELECT * FROM users ORDER BY created_at DESC")
-    return list(cur.fetchall())
+def list_users(projection: str = "list") -> List[Any]:
+    record_type, columns = _projection(_USER_PROJECTIONS, projection)
+    return _fetch_all(get_connection(), record_type, f"SELECT {columns} FROM users ORDER BY created_at DESC")
 
 
 def create_user(username: str, password_hash: str, is_admin: bool = False) -> int:
@@ -47,20 +115,21 @@ def set_user_password(username: str, password_hash: str) -> None:
 
 # -------------------- Settings --------------------
 
-def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
-    conn = get_connection()
+def get_setting(key: str, default: Optional[str] = None, snapshot: bool = False) -> Optional[str]:
+    conn = _read_connection(snapshot)
     cur = conn.execute("SELECT value FROM settings WHERE key = ?", (key,))
     row = cur.fetchone()
     return row[0] if row else default
 
 
-def set_setting(key: str, value: str) -> None:
+def set_setting(key: str, value: str, commit: bool = True) -> None:
     conn = get_connection()
     conn.execute(
         "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
         (key, value),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
 
 
 def list_settings() -> Dict[str, str]:
@@ -74,22 +143,31 @@ def list_settings() -> Dict[str, str]:
 
 # -------------------- Categories --------------------
 
-def list_categories() -> List[sqlite3.Row]:
+def list_categories(snapshot: bool = False) -> List[Category]:
+    conn = _read_connection(snapshot)
+    return _fetch_all(conn, Category, f"SELECT {_CATEGORY_COLUMNS} FROM categories ORDER BY name ASC")
+
+
+def get_category_by_id(category_id: int) -> Optional[Category]:
     conn = get_connection()
-    cur = conn.execute("SELECT * FROM categories ORDER BY name ASC")
-    return list(cur.fetchall())
+    return _fetch_one(conn, Category, f"SELECT {_CATEGORY_COLUMNS} FROM categories WHERE id = ?", (category_id,))
 
 
-def get_category_by_id(category_id: int) -> Optional[sqlite3.Row]:
+def get_category_by_slug(slug: str) -> Optional[Category]:
     conn = get_connection()
-    cur = conn.execute("SELECT * FROM categories WHERE id = ?", (category_id,))
-    return cur.fetchone()
+    return _fetch_one(conn, Category, f"SELECT {_CATEGORY_COLUMNS} FROM categories WHERE slug = ?", (slug,))
+
+
+def iter_category_urls(id_start: int, id_end: int) -> Iterator[Tuple[int, str]]:
+    cur = get_connection().cursor()
+    cur.row_factory = None
+    cur.execute("SELECT id, slug FROM categories WHERE id >= ? AND id < ? ORDER BY id", (id_start, id_end))
+    return iter(cur)
 
 
-def get_category_by_slug(slug: str) -> Optional[sqlite3.Row]:
+def get_max_category_id() -> int:
     conn = get_connection()
-    cur = conn.execute("SELECT * FROM categories WHERE slug = ?", (slug,))
-    return cur.fetchone()
+    return int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM categories").fetchone()[0])
 
 
 def create_category(name: str, slug_value: Optional[str] = None) -> int:
@@ -124,8 +202,12 @@ def list_products(
     search: Optional[str] = None,
     category_slug: Optional[str] = None,
     active_only: bool = True,
-) -> List[sqlite3.Row]:
-    conn = get_connection()
+    snapshot: bool = False,
+    projection: str = "full",
+    collapse_duplicates: bool = False,
+) -> List[Any]:
+    record_type, columns = _projection(_PRODUCT_PROJECTIONS, projection)
+    conn = _read_connection(snapshot)
     where = []
     params: List[Any] = []
     if search:
@@ -137,27 +219,59 @@ def list_products(
         params.append(category_slug)
     if active_only:
         where.append("p.active = 1")
+    if collapse_duplicates:
+        # One row per duplicate group (see app.dedupe): its cheapest matching
+        # offer. Only grouped products are ranked, so ungrouped ones cost nothing.
+        filters = "".join(f" AND {w}" for w in where)
+        where.append(
+            "p.id NOT IN (SELECT id FROM ("
+            "SELECT p.id AS id, ROW_NUMBER() OVER (PARTITION BY g.canonical_id ORDER BY p.price, p.id) AS offer_rank "
+            "FROM product_groups g JOIN products p ON p.id = g.product_id "
+            "LEFT JOIN categories c ON p.category_id = c.id"
+            f" WHERE 1 = 1{filters}"
+            ") WHERE offer_rank > 1)"
+        )
+        params = params + params
     where_sql = (" WHERE " + " AND ".join(where)) if where else ""
     sql = (
-        "SELECT p.*, c.name AS category_name, c.slug AS category_slug FROM products p "
+        f"SELECT {columns} FROM products p "
         "LEFT JOIN categories c ON p.category_id = c.id "
         + where_sql +
         " ORDER BY p.created_at DESC"
     )
-    cur = conn.execute(sql, tuple(params))
-    return list(cur.fetchall())
+    return _fetch_all(conn, record_type, sql, params)
 
 
-def get_product_by_id(product_id: int) -> Optional[sqlite3.Row]:
-    conn = get_connection()
-    cur = conn.execute("SELECT * FROM products WHERE id = ?", (product_id,))
-    return cur.fetchone()
+def list_products_without_description() -> List[Product]:
+    _, columns = _PRODUCT_PROJECTIONS["full"]
+    return _fetch_all(
+        get_connection(),
+        Product,
+        f"SELECT {columns} FROM products p LEFT JOIN categories c ON p.category_id = c.id "
+        "WHERE p.description IS NULL OR p.description = '' ORDER BY p.id",
+    )
 
 
-def get_product_by_slug(slug_value: str) -> Optional[sqlite3.Row]:
+def get_product_by_id(product_id: int) -> Optional[Product]:
+    _, columns = _PRODUCT_PROJECTIONS["full"]
     conn = get_connection()
-    cur = conn.execute("SELECT * FROM products WHERE slug = ?", (slug_value,))
-    return cur.fetchone()
+    return _fetch_one(
+        conn,
+        Product,
+        f"SELECT {columns} FROM products p LEFT JOIN categories c ON p.category_id = c.id WHERE p.id = ?",
+        (product_id,),
+    )
+
+
+def get_product_by_slug(slug_value: str, snapshot: bool = False) -> Optional[Product]:
+    _, columns = _PRODUCT_PROJECTIONS["full"]
+    conn = _read_connection(snapshot)
+    return _fetch_one(
+        conn,
+        Product,
+        f"SELECT {columns} FROM products p LEFT JOIN categories c ON p.category_id = c.id WHERE p.slug = ?",
+        (slug_value,),
+    )
 
 
 def _ensure_category_by_name(category_name: Optional[str]) -> Optional[int]:
@@ -183,11 +297,12 @@ def create_product(
     category_name: Optional[str],
     affiliate_url_template: Optional[str],
     active: bool = True,
+    commit: bool = True,
 ) -> int:
     slug_value = slugify(title)
     category_id = _ensure_category_by_name(category_name)
     conn = get_connection()
-    conn.execute(
+    cur = conn.execute(
         """
         INSERT INTO products (title, slug, description, price, currency, image_url, category_id, affiliate_url_template, active, created_at)
         VALUES (?,?,?,?,?,?,?,?,?,?)
@@ -205,8 +320,9 @@ def create_product(
             utc_now_iso(),
         ),
     )
-    conn.commit()
-    return int(conn.execute("SELECT last_insert_rowid()").fetchone()[0])
+    if commit:
+        conn.commit()
+    return int(cur.lastrowid)
 
 
 def update_product(
@@ -219,6 +335,7 @@ def update_product(
     category_name: Optional[str],
     affiliate_url_template: Optional[str],
     active: bool,
+    commit: bool = True,
 ) -> None:
     slug_value = slugify(title)
     category_id = _ensure_category_by_name(category_name)
@@ -242,21 +359,56 @@ def update_product(
             product_id,
         ),
     )
-    conn.commit()
+    if commit:
+        conn.commit()
 
 
 def delete_product(product_id: int) -> None:
+    # Call dedupe.remove_product first: its index rows are found through the
+    # product's stored signature
     conn = get_connection()
     conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+    conn.execute("DELETE FROM price_history WHERE product_id = ?", (product_id,))
+    conn.execute("DELETE FROM related_products WHERE product_id = ?", (product_id,))
+    # No index on the target column; a scan is fine for a one-off Admin delete
+    conn.execute("DELETE FROM related_products WHERE related_product_id = ?", (product_id,))
+    leave_duplicate_group(product_id, commit=False)
     conn.commit()
 
 
+def leave_duplicate_group(product_id: int, commit: bool = True) -> None:
+    # Takes a product out of its duplicate group (see app.dedupe); the next
+    # oldest member becomes canonical. Members that were only linked through
+    # this product stay grouped until the next rebuild.
+    conn = get_connection()
+    row = conn.execute("SELECT canonical_id FROM product_groups WHERE product_id = ?", (product_id,)).fetchone()
+    if row is not None:
+        canonical_id = row[0]
+        conn.execute("DELETE FROM product_groups WHERE product_id = ?", (product_id,))
+        if canonical_id == product_id:
+            remaining = conn.execute(
+                "SELECT MIN(product_id) FROM product_groups WHERE canonical_id = ?", (product_id,)
+            ).fetchone()[0]
+            if remaining is not None:
+                conn.execute("UPDATE product_groups SET canonical_id = ? WHERE canonical_id = ?", (remaining, product_id))
+            canonical_id = remaining
+        if canonical_id is not None and conn.execute(
+            "SELECT COUNT(*) FROM product_groups WHERE canonical_id = ?", (canonical_id,)
+        ).fetchone()[0] < 2:
+            conn.execute("DELETE FROM product_groups WHERE canonical_id = ?", (canonical_id,))
+    if commit:
+        conn.commit()
+
+
 def upsert_product_by_slug(
     slug_value: str,
     data: Dict[str, Any],
+    commit: bool = True,
 ) -> int:
     existing = get_product_by_slug(slug_value)
     if existing:
+        if "price" in data:
+            _record_price_change(int(existing["id"]), existing["price"], float(data["price"]))
         update_product(
             existing["id"],
             title=data.get("title", existing["title"]),
@@ -266,10 +418,11 @@ def upsert_product_by_slug(
             image_url=data.get("image_url", existing["image_url"]),
             category_name=data.get("category_name"),
             affiliate_url_template=data.get("affiliate_url_template", existing["affiliate_url_template"]),
-            active=bool(data.get("active", existing["active"]))
+            active=bool(data.get("active", existing["active"])),
+            commit=commit,
         )
         return int(existing["id"])
-    return create_product(
+    product_id = create_product(
         title=data.get("title", slug_value),
         description=data.get("description", ""),
         price=float(data.get("price", 0)),
@@ -278,21 +431,140 @@ def upsert_product_by_slug(
         category_name=data.get("category_name"),
         affiliate_url_template=data.get("affiliate_url_template"),
         active=bool(data.get("active", True)),
+        commit=False,
     )
+    _record_price_change(product_id, None, float(data.get("price", 0)))
+    if commit:
+        get_connection().commit()
+    return product_id
+
+
+# -------------------- Price history --------------------
+
+def _to_cents(price: float) -> int:
+    return int(round(price * 100))
+
+
+def _record_price_change(product_id: int, old_price: Optional[float], new_price: float) -> None:
+    # Called by imports; writes nothing unless the price actually moved. The
+    # first change of a product that predates price history also records the
+    # old price, so there is something to compare against.
+    if old_price is not None and _to_cents(old_price) == _to_cents(new_price):
+        return
+    conn = get_connection()
+    now = int(time.time())
+    latest = conn.execute(
+        "SELECT MAX(recorded_at) FROM price_history WHERE product_id = ?", (product_id,)
+    ).fetchone()[0]
+    if latest is None and old_price is not None:
+        conn.execute(
+            "INSERT INTO price_history (product_id, recorded_at, price_cents) VALUES (?,?,?)",
+            (product_id, now - 1, _to_cents(old_price)),
+        )
+    # Keys are whole seconds; a second change within the same second goes one
+    # second later rather than overwriting the first
+    conn.execute(
+        "INSERT INTO price_history (product_id, recorded_at, price_cents) VALUES (?,?,?)",
+        (product_id, now if latest is None else max(now, latest + 1), _to_cents(new_price)),
+    )
+
+
+def get_price_history(product_id: int, days: Optional[int] = None, snapshot: bool = False) -> List[Tuple[int, float]]:
+    # (recorded_at epoch seconds, price), oldest first. With days, the series
+    # starts at the last change before the window so it covers the whole window.
+    conn = _read_connection(snapshot)
+    if days is None:
+        cur = conn.execute(
+            "SELECT recorded_at, price_cents FROM price_history WHERE product_id = ? ORDER BY recorded_at",
+            (product_id,),
+        )
+    else:
+        since = int(time.time()) - days * 86400
+        cur = conn.execute(
+            "SELECT recorded_at, price_cents FROM price_history WHERE product_id = ? AND recorded_at >= COALESCE("
+            "(SELECT MAX(recorded_at) FROM price_history WHERE product_id = ? AND recorded_at < ?), ?) "
+            "ORDER BY recorded_at",
+            (product_id, product_id, since, since),
+        )
+    return [(recorded_at, price_cents / 100.0) for recorded_at, price_cents in cur]
+
+
+def list_price_drops(days: int = 7, limit: int = 20, snapshot: bool = False) -> List[PriceDrop]:
+    # Active products now cheaper than at the start of the window (or than
+    # their first price inside it), biggest relative drop first. Only products
+    # with a change inside the window are looked at.
+    since = int(time.time()) - days * 86400
+    conn = _read_connection(snapshot)
+    return _fetch_all(
+        conn,
+        PriceDrop,
+        """
+        SELECT id, title, slug, image_url, currency, previous_cents / 100.0, price,
+               (previous_cents - ROUND(price * 100)) * 100.0 / previous_cents AS drop_pct
+        FROM (
+            SELECT p.id, p.title, p.slug, p.image_url, p.currency, p.price,
+                   COALESCE(
+                       (SELECT h.price_cents FROM price_history h
+                        WHERE h.product_id = p.id AND h.recorded_at < ? ORDER BY h.recorded_at DESC LIMIT 1),
+                       (SELECT h.price_cents FROM price_history h
+                        WHERE h.product_id = p.id AND h.recorded_at >= ? ORDER BY h.recorded_at LIMIT 1)
+                   ) AS previous_cents
+            FROM (
+                -- Without the hint the planner walks the whole table in primary key order
+                SELECT DISTINCT product_id FROM price_history INDEXED BY idx_price_history_recorded
+                WHERE recorded_at >= ?
+            ) changed
+            JOIN products p ON p.id = changed.product_id
+            WHERE p.active = 1
+        )
+        WHERE previous_cents > ROUND(price * 100)
+        ORDER BY drop_pct DESC
+        LIMIT ?
+        """,
+        (since, since, since, limit),
+    )
+
+
+def list_related_products(product_id: int, limit: int = 8, snapshot: bool = False) -> List[ProductListItem]:
+    _, columns = _PRODUCT_PROJECTIONS["list"]
+    conn = _read_connection(snapshot)
+    return _fetch_all(
+        conn,
+        ProductListItem,
+        f"SELECT {columns} FROM related_products r "
+        "JOIN products p ON p.id = r.related_product_id "
+        "LEFT JOIN categories c ON p.category_id = c.id "
+        "WHERE r.product_id = ? AND p.active = 1 ORDER BY r.rank LIMIT ?",
+        (product_id, limit),
+    )
+
+
+def iter_active_product_urls(id_start: int, id_end: int) -> Iterator[Tuple[int, str, str]]:
+    # (id, slug, created_at) for ids in [id_start, id_end), streamed straight off the cursor
+    cur = get_connection().cursor()
+    cur.row_factory = None
+    cur.execute(
+        "SELECT id, slug, created_at FROM products WHERE id >= ? AND id < ? AND active = 1 ORDER BY id",
+        (id_start, id_end),
+    )
+    return iter(cur)
+
+
+def get_max_product_id() -> int:
+    conn = get_connection()
+    return int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM products").fetchone()[0])
 
 
 # -------------------- Affiliates --------------------
 
-def list_affiliates() -> List[sqlite3.Row]:
+def list_affiliates() -> List[Affiliate]:
     conn = get_connection()
-    cur = conn.execute("SELECT * FROM affiliates ORDER BY created_at DESC")
-    return list(cur.fetchall())
+    return _fetch_all(conn, Affiliate, f"SELECT {_AFFILIATE_COLUMNS} FROM affiliates ORDER BY created_at DESC")
 
 
-def get_affiliate_by_code(code: str) -> Optional[sqlite3.Row]:
+def get_affiliate_by_code(code: str) -> Optional[Affiliate]:
     conn = get_connection()
-    cur = conn.execute("SELECT * FROM affiliates WHERE code = ?", (code,))
-    return cur.fetchone()
+    return _fetch_one(conn, Affiliate, f"SELECT {_AFFILIATE_COLUMNS} FROM affiliates WHERE code = ?", (code,))
 
 
 def create_affiliate(name: str, code: str) -> int:
@@ -305,6 +577,16 @@ def create_affiliate(name: str, code: str) -> int:
     return int(conn.execute("SELECT last_insert_rowid()").fetchone()[0])
 
 
+def list_affiliate_commissions() -> List[sqlite3.Row]:
+    conn = get_connection()
+    cur = conn.execute(
+        "SELECT a.id, a.name, a.code, ac.orders_count, ac.revenue, ac.commission, ac.updated_at "
+        "FROM affiliate_commissions ac JOIN affiliates a ON a.id = ac.affiliate_id "
+        "ORDER BY ac.commission DESC"
+    )
+    return list(cur.fetchall())
+
+
 # -------------------- Orders --------------------
 
 def create_order(
@@ -337,35 +619,62 @@ def log_click(product_id: int, affiliate_id: Optional[int], referrer: Optional[s
 
 # -------------------- Blog --------------------
 
-def list_blog_posts(status: Optional[str] = None) -> List[sqlite3.Row]:
-    conn = get_connection()
+def list_blog_posts(
+    status: Optional[str] = None,
+    snapshot: bool = False,
+    projection: str = "full",
+    limit: Optional[int] = None,
+) -> List[Any]:
+    record_type, columns = _projection(_BLOG_POST_PROJECTIONS, projection)
+    conn = _read_connection(snapshot)
     where = []
     params: List[Any] = []
     if status:
         where.append("status = ?")
         params.append(status)
     where_sql = (" WHERE " + " AND ".join(where)) if where else ""
-    cur = conn.execute(
-        "SELECT * FROM blog_posts" + where_sql + " ORDER BY created_at DESC",
-        tuple(params),
+    limit_sql = ""
+    if limit is not None:
+        limit_sql = " LIMIT ?"
+        params.append(int(limit))
+    return _fetch_all(
+        conn,
+        record_type,
+        f"SELECT {columns} FROM blog_posts" + where_sql + " ORDER BY created_at DESC" + limit_sql,
+        params,
     )
-    return list(cur.fetchall())
 
 
-def get_blog_post_by_slug(slug_value: str) -> Optional[sqlite3.Row]:
+def get_blog_post_by_slug(slug_value: str, snapshot: bool = False) -> Optional[BlogPost]:
+    _, columns = _BLOG_POST_PROJECTIONS["full"]
+    conn = _read_connection(snapshot)
+    return _fetch_one(conn, BlogPost, f"SELECT {columns} FROM blog_posts WHERE slug = ?", (slug_value,))
+
+
+def iter_published_post_urls(id_start: int, id_end: int) -> Iterator[Tuple[int, str, str]]:
+    cur = get_connection().cursor()
+    cur.row_factory = None
+    cur.execute(
+        "SELECT id, slug, updated_at FROM blog_posts WHERE id >= ? AND id < ? AND status = 'published' ORDER BY id",
+        (id_start, id_end),
+    )
+    return iter(cur)
+
+
+def get_max_blog_post_id() -> int:
     conn = get_connection()
-    cur = conn.execute("SELECT * FROM blog_posts WHERE slug = ?", (slug_value,))
-    return cur.fetchone()
+    return int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM blog_posts").fetchone()[0])
 
 
-def create_blog_post(title: str, content_md: str, status: str = "draft") -> int:
+def create_blog_post(title: str, content_md: str, status: str = "draft", commit: bool = True) -> int:
     conn = get_connection()
-    conn.execute(
+    cur = conn.execute(
         "INSERT INTO blog_posts (title, slug, content_md, status, created_at, updated_at) VALUES (?,?,?,?,?,?)",
         (title, slugify(title), content_md, status, utc_now_iso(), utc_now_iso()),
     )
-    conn.commit()
-    return int(conn.execute("SELECT last_insert_rowid()").fetchone()[0])
+    if commit:
+        conn.commit()
+    return int(cur.lastrowid)
 
 
 def update_blog_post(
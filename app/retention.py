@@ -0,0 +1,180 @@
+import glob
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+from .attribution import oldest_click_needed
+from .database import get_connection
+from .models import Click
+from .settings import get_archive_dir
+from . import repositories as repo
+
+
+ROLLUP_WATERMARK_KEY = "click_rollup_watermark"
+ARCHIVE_WATERMARK_KEY = "click_archive_watermark"
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_BATCH_SIZE = 5000
+
+_CLICK_COLUMNS = Click._fields
+
+
+def _archive_path(month: str) -> str:
+    return os.path.join(get_archive_dir(), f"clicks-{month}.ndjson.gz")
+
+
+def rollup_clicks() -> int:
+    # Folds clicks past the rollup watermark into per-day counters
+    conn = get_connection()
+    after_id = int(repo.get_setting(ROLLUP_WATERMARK_KEY, "0") or 0)
+    until_id = int(conn.execute("SELECT COALESCE(MAX(id), 0) FROM clicks").fetchone()[0])
+    if until_id <= after_id:
+        return 0
+    cur = conn.execute(
+        """
+        INSERT INTO click_daily_rollups (day, product_id, affiliate_id, clicks)
+        SELECT substr(created_at, 1, 10), product_id, COALESCE(affiliate_id, 0), COUNT(*)
+        FROM clicks WHERE id > ? AND id <= ?
+        GROUP BY 1, 2, 3
+        ON CONFLICT(day, product_id, affiliate_id) DO UPDATE SET clicks = clicks + excluded.clicks
+        """,
+        (after_id, until_id),
+    )
+    repo.set_setting(ROLLUP_WATERMARK_KEY, str(until_id), commit=False)
+    conn.commit()
+    return cur.rowcount
+
+
+def archive_old_clicks(
+    retention_days: Optional[int] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    vacuum_pages: Optional[int] = None,
+) -> Dict[str, int]:
+    # Moves clicks older than the retention window into monthly gzip NDJSON files.
+    # Only clicks already covered by rollups, and older than anything attribution
+    # may still read from the hot table, are archived. Each batch is fsynced to
+    # the archive before it is deleted from the hot table, and the archive
+    # watermark moves in the same transaction as the delete.
+    if retention_days is None:
+        retention_days = int(repo.get_setting("click_retention_days", str(DEFAULT_RETENTION_DAYS)) or DEFAULT_RETENTION_DAYS)
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).isoformat()
+    cutoff = min(cutoff, oldest_click_needed())
+
+    rollup_clicks()
+    conn = get_connection()
+    rolled_up_id = int(repo.get_setting(ROLLUP_WATERMARK_KEY, "0") or 0)
+    archived_id = int(repo.get_setting(ARCHIVE_WATERMARK_KEY, "0") or 0)
+    result = {"archived": 0, "batches": 0, "vacuumed_pages": 0}
+
+    done = False
+    while not done:
+        cur = conn.cursor()
+        cur.row_factory = None
+        rows = cur.execute(
+            "SELECT id, product_id, affiliate_id, referrer, created_at FROM clicks "
+            "WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+            (archived_id, rolled_up_id, batch_size),
+        ).fetchall()
+        # clicks are append-only, so created_at grows with id: stop at the first recent one
+        batch = []
+        for row in rows:
+            if row[4] >= cutoff:
+                done = True
+                break
+            batch.append(row)
+        if len(rows) < batch_size:
+            done = True
+        if not batch:
+            break
+
+        by_month: Dict[str, List[str]] = {}
+        for row in batch:
+            by_month.setdefault(row[4][:7], []).append(json.dumps(dict(zip(_CLICK_COLUMNS, row))))
+        for month, lines in by_month.items():
+            with gzip.open(_archive_path(month), "at", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+        first_id, last_id = batch[0][0], batch[-1][0]
+        conn.execute("DELETE FROM clicks WHERE id >= ? AND id <= ?", (first_id, last_id))
+        repo.set_setting(ARCHIVE_WATERMARK_KEY, str(last_id), commit=False)
+        conn.commit()
+        archived_id = last_id
+        result["archived"] += len(batch)
+        result["batches"] += 1
+
+    if result["archived"] and int(conn.execute("PRAGMA auto_vacuum").fetchone()[0]) == 2:
+        freed = int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+        # The pragma frees one page per step and execute() only steps once;
+        # executescript runs it to completion.
+        pages = "" if vacuum_pages is None else f"({int(vacuum_pages)})"
+        conn.executescript(f"PRAGMA incremental_vacuum{pages};")
+        result["vacuumed_pages"] = freed - int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+    return result
+
+
+def list_archive_months() -> List[str]:
+    months = []
+    for path in glob.glob(os.path.join(get_archive_dir(), "clicks-*.ndjson.gz")):
+        months.append(os.path.basename(path)[len("clicks-"):-len(".ndjson.gz")])
+    return sorted(months)
+
+
+def _iter_archive_month(month: str, archived_id: int) -> Iterator[Dict[str, Any]]:
+    # A crash between fsync and commit leaves rows past the watermark in the file
+    # (they are still hot) and the next run appends them again, so ids go
+    # backwards. Rows are otherwise written in id order; skip both cases.
+    last_id = 0
+    with gzip.open(_archive_path(month), "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record["id"] <= last_id or record["id"] > archived_id:
+                continue
+            last_id = record["id"]
+            yield record
+
+
+def iter_clicks(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    product_id: Optional[int] = None,
+) -> Iterator[Click]:
+    # Clicks in [since, until) from archived months first, then the hot table
+    archived_id = int(repo.get_setting(ARCHIVE_WATERMARK_KEY, "0") or 0)
+    for month in list_archive_months():
+        if since and month < since[:7]:
+            continue
+        if until and month > until[:7]:
+            continue
+        for record in _iter_archive_month(month, archived_id):
+            if since and record["created_at"] < since:
+                continue
+            if until and record["created_at"] >= until:
+                continue
+            if product_id is not None and record["product_id"] != product_id:
+                continue
+            yield Click._make(record[name] for name in _CLICK_COLUMNS)
+
+    where = []
+    params: List[Any] = []
+    if since:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until:
+        where.append("created_at < ?")
+        params.append(until)
+    if product_id is not None:
+        where.append("product_id = ?")
+        params.append(product_id)
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    cur = get_connection().cursor()
+    cur.row_factory = None
+    cur.execute(
+        "SELECT id, product_id, affiliate_id, referrer, created_at FROM clicks" + where_sql + " ORDER BY id",
+        tuple(params),
+    )
+    yield from map(Click._make, cur)
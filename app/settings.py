@@ -6,14 +6,43 @@ def get_project_root() -> str:
 
 
 def get_data_dir() -> str:
-    data_dir = os.path.join(get_project_root(), "data")
+    # APP_DATA_DIR points the app at another database and data files (e.g. for load tests)
+    data_dir = os.environ.get("APP_DATA_DIR") or os.path.join(get_project_root(), "data")
     os.makedirs(data_dir, exist_ok=True)
     return data_dir
 
 
+def get_archive_dir() -> str:
+    archive_dir = os.path.join(get_data_dir(), "archive")
+    os.makedirs(archive_dir, exist_ok=True)
+    return archive_dir
+
+
+def get_sitemap_dir() -> str:
+    sitemap_dir = os.path.join(get_data_dir(), "sitemaps")
+    os.makedirs(sitemap_dir, exist_ok=True)
+    return sitemap_dir
+
+
+def get_profile_dir() -> str:
+    profile_dir = os.path.join(get_data_dir(), "profiles")
+    os.makedirs(profile_dir, exist_ok=True)
+    return profile_dir
+
+
+def get_related_dir() -> str:
+    related_dir = os.path.join(get_data_dir(), "related")
+    os.makedirs(related_dir, exist_ok=True)
+    return related_dir
+
+
 def get_db_path() -> str:
     return os.path.join(get_data_dir(), "app.db")
 
 
+def get_snapshot_path() -> str:
+    return os.path.join(get_data_dir(), "snapshot.db")
+
+
 def get_default_site_name() -> str:
     return "Affiliate eShop"
\ No newline at end of file
@@ -0,0 +1,203 @@
+import gzip
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+from .settings import get_sitemap_dir
+from .utils import utc_now_iso
+from . import repositories as repo
+
+
+# Sitemaps are limited to 50k URLs per file. Shards cover fixed id ranges of
+# that width, so a shard's contents only change when rows in its range change
+# and every other shard can be left alone.
+SHARD_SIZE = 50000
+RSS_ITEMS = 50
+_WRITE_CHUNK = 2000
+_STATE_FILE = "state.json"
+
+
+def _base_url() -> str:
+    base = repo.get_setting("site_url") or ""
+    if not base:
+        raise ValueError("Set the public site URL in Admin → Settings first")
+    return base.rstrip("/")
+
+
+def _files_url(base: str) -> str:
+    # Public URL of the directory the sitemap files are deployed to. Streamlit
+    # does not serve data/sitemaps itself; see the README.
+    files_url = repo.get_setting("sitemap_files_url") or ""
+    return (files_url or f"{base}/sitemaps").rstrip("/")
+
+
+# Entry generators get the base URL already XML-escaped; quote() leaves
+# nothing in the slug that needs escaping, so locs are emitted as-is.
+
+
+def _product_entries(base: str, id_start: int, id_end: int) -> Iterator[Tuple[str, str]]:
+    for _, slug, created_at in repo.iter_active_product_urls(id_start, id_end):
+        yield f"{base}/Shop?product={quote(slug)}", created_at[:10]
+
+
+def _category_entries(base: str, id_start: int, id_end: int) -> Iterator[Tuple[str, str]]:
+    for _, slug in repo.iter_category_urls(id_start, id_end):
+        yield f"{base}/Shop?category={quote(slug)}", ""
+
+
+def _post_entries(base: str, id_start: int, id_end: int) -> Iterator[Tuple[str, str]]:
+    for _, slug, updated_at in repo.iter_published_post_urls(id_start, id_end):
+        yield f"{base}/Blog?post={quote(slug)}", updated_at[:10]
+
+
+_SECTIONS: List[Tuple[str, Callable[[], int], Callable[[str, int, int], Iterator[Tuple[str, str]]]]] = [
+    ("products", repo.get_max_product_id, _product_entries),
+    ("categories", repo.get_max_category_id, _category_entries),
+    ("posts", repo.get_max_blog_post_id, _post_entries),
+]
+
+
+def _fingerprint(entries: Iterable[Tuple[str, str]]) -> Tuple[int, int]:
+    crc = 0
+    count = 0
+    for loc, lastmod in entries:
+        crc = zlib.crc32(f"{loc}\t{lastmod}\n".encode("utf-8"), crc)
+        count += 1
+    return crc, count
+
+
+def _write_gzip_atomic(path: str, chunks: Iterable[str]) -> None:
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+        for chunk in chunks:
+            f.write(chunk.encode("utf-8"))
+    os.replace(tmp_path, path)
+
+
+def _urlset(entries: Iterable[Tuple[str, str]]) -> Iterator[str]:
+    # Lines are joined into chunks so the gzip writer sees a few large writes
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    lines: List[str] = []
+    for loc, lastmod in entries:
+        if lastmod:
+            lines.append(f"<url><loc>{loc}</loc><lastmod>{lastmod}</lastmod></url>\n")
+        else:
+            lines.append(f"<url><loc>{loc}</loc></url>\n")
+        if len(lines) >= _WRITE_CHUNK:
+            yield "".join(lines)
+            lines.clear()
+    lines.append("</urlset>\n")
+    yield "".join(lines)
+
+
+def _load_state(sitemap_dir: str) -> Dict:
+    try:
+        with open(os.path.join(sitemap_dir, _STATE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_state(sitemap_dir: str, state: Dict) -> None:
+    tmp_path = os.path.join(sitemap_dir, _STATE_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, os.path.join(sitemap_dir, _STATE_FILE))
+
+
+def generate_sitemaps(force: bool = False) -> Dict[str, int]:
+    # Streams rows into gzipped shard files plus a sitemap.xml index. Each
+    # shard is fingerprinted first (a cheap read-only pass) and only rewritten
+    # when its fingerprint differs from the last run.
+    base = _base_url()
+    escaped_base = escape(base)
+    sitemap_dir = get_sitemap_dir()
+    previous = _load_state(sitemap_dir)
+    if previous.get("base_url") != base:
+        force = True
+    shards = {} if force else dict(previous.get("shards", {}))
+    result = {"shards": 0, "written": 0, "skipped": 0, "urls": 0}
+
+    live = set()
+    for section, max_id, entries in _SECTIONS:
+        top = max_id()
+        for shard_start in range(0, top + 1, SHARD_SIZE):
+            name = f"sitemap-{section}-{shard_start // SHARD_SIZE}.xml.gz"
+            shard_end = shard_start + SHARD_SIZE
+            crc, count = _fingerprint(entries(escaped_base, shard_start, shard_end))
+            if count == 0:
+                continue
+            live.add(name)
+            result["shards"] += 1
+            result["urls"] += count
+            known = shards.get(name)
+            path = os.path.join(sitemap_dir, name)
+            if known and known["crc"] == crc and known["count"] == count and os.path.exists(path):
+                result["skipped"] += 1
+                continue
+            _write_gzip_atomic(path, _urlset(entries(escaped_base, shard_start, shard_end)))
+            shards[name] = {"crc": crc, "count": count, "lastmod": utc_now_iso()}
+            result["written"] += 1
+
+    for name in list(shards):
+        if name not in live:
+            del shards[name]
+            path = os.path.join(sitemap_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    escaped_files_url = escape(_files_url(base))
+    index = ['<?xml version="1.0" encoding="UTF-8"?>\n', '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    for name in sorted(shards):
+        index.append(
+            f"<sitemap><loc>{escaped_files_url}/{name}</loc><lastmod>{shards[name]['lastmod'][:10]}</lastmod></sitemap>\n"
+        )
+    index.append("</sitemapindex>\n")
+    tmp_path = os.path.join(sitemap_dir, "sitemap.xml.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(index)
+    os.replace(tmp_path, os.path.join(sitemap_dir, "sitemap.xml"))
+
+    _save_state(sitemap_dir, {"base_url": base, "shards": shards})
+    return result
+
+
+def _rfc822(iso_value: str) -> str:
+    try:
+        value = datetime.fromisoformat(iso_value)
+    except ValueError:
+        return ""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value)
+
+
+def generate_rss(limit: int = RSS_ITEMS) -> int:
+    base = _base_url()
+    site_name = repo.get_setting("site_name", "Affiliate eShop") or "Affiliate eShop"
+    posts = repo.list_blog_posts(status="published", projection="list", limit=limit)
+
+    def chunks() -> Iterator[str]:
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0"><channel>\n'
+        yield f"<title>{escape(site_name)} – Blog</title><link>{escape(base)}/Blog</link>"
+        yield f"<description>{escape(site_name)} blog</description>\n"
+        for p in posts:
+            link = escape(f"{base}/Blog?post={quote(p['slug'])}")
+            excerpt = (p["excerpt"] or "").split("\n\n")[0][:240]
+            yield (
+                f"<item><title>{escape(p['title'])}</title><link>{link}</link><guid>{link}</guid>"
+                f"<pubDate>{_rfc822(p['created_at'])}</pubDate><description>{escape(excerpt)}</description></item>\n"
+            )
+        yield "</channel></rss>\n"
+
+    sitemap_dir = get_sitemap_dir()
+    tmp_path = os.path.join(sitemap_dir, "rss.xml.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(chunks())
+    os.replace(tmp_path, os.path.join(sitemap_dir, "rss.xml"))
+    return len(posts)
@@ -1,62 +1,135 @@
+import csv
+import io
 import json
-from typing import Any, Dict, List, Tuple
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
 from urllib.parse import urlparse
 
+from .database import get_connection
+from .dedupe import update_duplicate_groups
+from .related import update_related_products
 from .utils import slugify
 from . import repositories as repo
 
 
-def _normalize_product_record(item: Dict[str, Any]) -> Dict[str, Any]:
-    title = str(
-        item.get("title")
-        or item.get("name")
-        or item.get("product_name")
-        or item.get("id")
-        or "Untitled"
-    )
-    price_value = item.get("price") or item.get("amount") or item.get("price_cents")
-    if isinstance(price_value, str):
+FEED_FORMATS = {
+    "json": "JSON",
+    "xml": "Google Merchant XML (RSS/Atom)",
+    "csv": "CSV",
+    "tsv": "TSV",
+}
+COMMIT_EVERY = 500
+
+# Source field names for each product field, best first. Google Merchant
+# attributes (image_link, link, product_type, ...) sit alongside the names
+# our JSON feeds use; XML tags and CSV headers are matched without namespace
+# prefix, case or spaces.
+_FIELD_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "title": ("title", "name", "product_name", "id"),
+    "price": ("price", "amount", "price_cents"),
+    "currency": ("currency", "ccy"),
+    "image_url": ("image_url", "image_link", "image", "thumbnail"),
+    "category_name": ("category", "category_name", "product_type", "google_product_category"),
+    "slug": ("slug",),
+    "description": ("description", "summary", "content"),
+    "affiliate_url_template": ("affiliate_url_template", "buy_url", "url", "link"),
+    "availability": ("availability",),
+}
+_UNAVAILABLE = {"out of stock", "out_of_stock", "discontinued"}
+
+
+def _coerce_price(value: Any) -> Tuple[float, Optional[str]]:
+    # Returns (price, currency); Google Merchant prices look like "15.00 USD"
+    currency = None
+    if isinstance(value, str):
+        parts = value.split()
+        if len(parts) == 2 and len(parts[1]) == 3 and parts[1].isalpha():
+            value, currency = parts[0], parts[1].upper()
         try:
-            price_value = float(price_value)
+            value = float(value)
         except Exception:
-            price_value = 0
-    if isinstance(price_value, int):
+            value = 0
+    if isinstance(value, int):
         # if looks like cents, convert to dollars if large
-        price_value = price_value / 100.0 if price_value > 1000 else float(price_value)
-    currency = item.get("currency") or item.get("ccy") or "USD"
-    image_url = item.get("image_url") or item.get("image") or item.get("thumbnail")
-    category_name = item.get("category") or item.get("category_name")
-    slug_value = item.get("slug") or slugify(title)
-    description = (
-        item.get("description")
-        or item.get("summary")
-        or item.get("content")
-        or ""
-    )
-    affiliate_url_template = (
-        item.get("affiliate_url_template")
-        or item.get("buy_url")
-        or item.get("url")
-    )
-    if affiliate_url_template and "{affiliate_code}" not in affiliate_url_template:
+        value = value / 100.0 if value > 1000 else float(value)
+    return float(value or 0), currency
+
+
+def _with_affiliate_placeholder(url: Optional[str]) -> Optional[str]:
+    if url and "{affiliate_code}" not in url:
         # Best effort: append placeholder
-        join_char = "&" if "?" in affiliate_url_template else "?"
-        affiliate_url_template = f"{affiliate_url_template}{join_char}aff={{affiliate_code}}"
+        join_char = "&" if "?" in url else "?"
+        url = f"{url}{join_char}aff={{affiliate_code}}"
+    return url
+
+
+def _build_record(fields: Dict[str, Any]) -> Dict[str, Any]:
+    # fields holds the raw value of each product field that the feed provides
+    title = str(fields.get("title") or "Untitled")
+    price, price_currency = _coerce_price(fields.get("price"))
+    if fields.get("price_in_cents"):
+        price = price / 100.0
+    availability = str(fields.get("availability") or "").strip().lower()
     return {
         "title": title,
-        "slug": slug_value,
-        "description": description,
-        "price": float(price_value or 0),
-        "currency": str(currency),
-        "image_url": image_url,
-        "category_name": category_name,
-        "affiliate_url_template": affiliate_url_template,
-        "active": True,
+        "slug": fields.get("slug") or slugify(title),
+        "description": fields.get("description") or "",
+        "price": price,
+        "currency": str(fields.get("currency") or price_currency or "USD"),
+        "image_url": fields.get("image_url"),
+        "category_name": fields.get("category_name"),
+        "affiliate_url_template": _with_affiliate_placeholder(fields.get("affiliate_url_template")),
+        "active": availability not in _UNAVAILABLE,
     }
 
 
+def _normalize_product_record(item: Dict[str, Any]) -> Dict[str, Any]:
+    fields = {}
+    for field, aliases in _FIELD_ALIASES.items():
+        for alias in aliases:
+            if item.get(alias):
+                fields[field] = item[alias]
+                break
+    return _build_record(fields)
+
+
+def _normalize_name(name: str) -> str:
+    # "{http://base.google.com/ns/1.0}image_link", "g:image_link" and "Image Link" all become "image_link"
+    name = name.rsplit("}", 1)[-1].rsplit(":", 1)[-1]
+    return name.strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def _compile_field_lookup() -> Dict[str, Tuple[str, int]]:
+    # source name -> (product field, priority); lower priority wins
+    lookup = {}
+    for field, aliases in _FIELD_ALIASES.items():
+        for priority, alias in enumerate(aliases):
+            lookup[alias] = (field, priority)
+    return lookup
+
+
+@contextmanager
+def _open_feed_stream(feed_url: str) -> Iterator[BinaryIO]:
+    # Binary stream over the feed, read incrementally rather than loaded whole
+    parsed = urlparse(feed_url)
+    if parsed.scheme in ("http", "https"):
+        with requests.get(feed_url, timeout=20, stream=True) as resp:
+            resp.raise_for_status()
+            resp.raw.decode_content = True  # undo any gzip transfer encoding
+            yield resp.raw
+        return
+    path = parsed.path if parsed.scheme == "file" else feed_url
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        raise ValueError(f"Unsupported or not found feed source: {feed_url}")
+    with f:
+        yield f
+
+
 def _load_json_from_source(feed_url: str) -> Any:
     parsed = urlparse(feed_url)
     if parsed.scheme in ("http", "https"):
@@ -75,6 +148,39 @@ def _load_json_from_source(feed_url: str) -> Any:
         raise ValueError(f"Unsupported or not found feed source: {feed_url}")
 
 
+def _upsert_records(records: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+    # Commits every COMMIT_EVERY rows instead of once per product, and updates
+    # the duplicate index for each committed batch. Related products are
+    # updated once for the whole import, since each update loads the saved
+    # TF-IDF model.
+    conn = get_connection()
+    created = 0
+    updated = 0
+    pending: List[int] = []
+    touched: List[int] = []
+    try:
+        for normalized in records:
+            slug_value = normalized.get("slug") or slugify(normalized.get("title", ""))
+            existing = repo.get_product_by_slug(slug_value)
+            pending.append(repo.upsert_product_by_slug(slug_value, normalized, commit=False))
+            touched.append(pending[-1])
+            if existing:
+                updated += 1
+            else:
+                created += 1
+            if len(pending) >= COMMIT_EVERY:
+                conn.commit()
+                update_duplicate_groups(pending)
+                pending = []
+    finally:
+        conn.commit()
+    if pending:
+        update_duplicate_groups(pending)
+    if touched:
+        update_related_products(touched)
+    return (created, updated)
+
+
 def import_products_from_json_feed(feed_url: str) -> Tuple[int, int]:
     if not feed_url:
         return (0, 0)
@@ -92,15 +198,119 @@ def import_products_from_json_feed(feed_url: str) -> Tuple[int, int]:
                 break
         else:
             products = []
-    created = 0
-    updated = 0
-    for item in products:
-        normalized = _normalize_product_record(item)
-        slug_value = normalized.get("slug") or slugify(normalized.get("title", ""))
-        existing = repo.get_product_by_slug(slug_value)
-        repo.upsert_product_by_slug(slug_value, normalized)
-        if existing:
-            updated += 1
-        else:
-            created += 1
-    return (created, updated)
\ No newline at end of file
+    return _upsert_records(_normalize_product_record(item) for item in products)
+
+
+def _iter_xml_records(stream: BinaryIO) -> Iterator[Dict[str, Any]]:
+    # One record per RSS <item> or Atom <entry>. Each item is detached from
+    # its parent once read, so memory stays flat however long the feed is.
+    aliases = _compile_field_lookup()
+    tag_fields: Dict[str, Optional[Tuple[str, int, str]]] = {}
+    stack: List[ET.Element] = []
+    depth_of_item = -1
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            if depth_of_item < 0 and _normalize_name(elem.tag) in ("item", "entry"):
+                depth_of_item = len(stack)
+            continue
+        stack.pop()
+        if len(stack) + 1 != depth_of_item:
+            continue
+        depth_of_item = -1
+        fields: Dict[str, Any] = {}
+        best: Dict[str, int] = {}
+        price_source = None
+        for child in elem:
+            if child.tag not in tag_fields:
+                name = _normalize_name(child.tag)
+                match = aliases.get(name)
+                tag_fields[child.tag] = (match[0], match[1], name) if match else None
+            target = tag_fields[child.tag]
+            if target is None:
+                continue
+            field, priority, name = target
+            # Atom links carry the URL in href rather than text
+            value = (child.text or "").strip() or child.get("href")
+            if value and priority < best.get(field, len(_FIELD_ALIASES[field])):
+                best[field] = priority
+                fields[field] = value
+                if field == "price":
+                    price_source = name
+        if price_source == "price_cents":
+            fields["price_in_cents"] = True
+        if stack:
+            stack[-1].remove(elem)
+        elem.clear()
+        yield _build_record(fields)
+
+
+def _compile_csv_header(header: List[str]) -> Tuple[List[Tuple[str, int]], bool]:
+    # (product field, column index) for the best column of each field, and
+    # whether the price column holds cents
+    aliases = _compile_field_lookup()
+    chosen: Dict[str, Tuple[int, int, str]] = {}
+    for index, column in enumerate(header):
+        name = _normalize_name(column)
+        match = aliases.get(name)
+        if match is None:
+            continue
+        field, priority = match
+        if field not in chosen or priority < chosen[field][0]:
+            chosen[field] = (priority, index, name)
+    columns = [(field, index) for field, (_, index, _) in chosen.items()]
+    price_in_cents = "price" in chosen and chosen["price"][2] == "price_cents"
+    return columns, price_in_cents
+
+
+def _iter_csv_records(stream: BinaryIO, delimiter: str) -> Iterator[Dict[str, Any]]:
+    # newline="" leaves line splitting to the csv module: only \r and \n end
+    # a row, and line breaks inside quoted fields are kept as they are
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        reader = csv.reader(text, delimiter=delimiter)
+        header = next(reader, None)
+        if not header:
+            return
+        columns, price_in_cents = _compile_csv_header(header)
+        for row in reader:
+            if not row:
+                continue
+            fields: Dict[str, Any] = {
+                field: row[index].strip() for field, index in columns if index < len(row) and row[index].strip()
+            }
+            if price_in_cents:
+                fields["price_in_cents"] = True
+            yield _build_record(fields)
+    finally:
+        # The caller owns and closes the stream (urllib3 closes its own at EOF)
+        if not text.closed:
+            text.detach()
+
+
+def import_products_from_xml_feed(feed_url: str) -> Tuple[int, int]:
+    if not feed_url:
+        return (0, 0)
+    with _open_feed_stream(feed_url) as stream:
+        return _upsert_records(_iter_xml_records(stream))
+
+
+def import_products_from_csv_feed(feed_url: str, delimiter: str = ",") -> Tuple[int, int]:
+    if not feed_url:
+        return (0, 0)
+    with _open_feed_stream(feed_url) as stream:
+        return _upsert_records(_iter_csv_records(stream, delimiter))
+
+
+_IMPORTERS: Dict[str, Callable[[str], Tuple[int, int]]] = {
+    "json": import_products_from_json_feed,
+    "xml": import_products_from_xml_feed,
+    "csv": import_products_from_csv_feed,
+    "tsv": lambda feed_url: import_products_from_csv_feed(feed_url, delimiter="\t"),
+}
+
+
+def import_products_from_feed(feed_url: str, feed_format: str = "json") -> Tuple[int, int]:
+    if feed_format not in _IMPORTERS:
+        raise ValueError(f"Unknown feed format: {feed_format}")
+    return _IMPORTERS[feed_format](feed_url)
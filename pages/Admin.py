@@ -1,9 +1,21 @@
+import html
 import json
+import os
+import secrets
+import zlib
 import streamlit as st
 
 from app import repositories as repo
 from app.auth import ensure_default_admin, hash_password
-from app.workflows import import_products_from_json_feed
+from app.workflows import FEED_FORMATS, import_products_from_feed
+from app.attribution import run_attribution
+from app.retention import archive_old_clicks
+from app.related import rebuild_related_products, update_related_products
+from app.dedupe import DEFAULT_SIMILARITY, SIMILARITY_KEY, rebuild_duplicate_groups, remove_product
+from app.generation import generate_blog_posts, generate_product_descriptions
+from app.sitemap import generate_rss, generate_sitemaps
+from app.database import get_snapshot_age, get_snapshot_max_age, publish_snapshot
+from app.profiling import DEFAULT_KEEP, QUERY_PARAM, list_profiles, load_profile
 
 st.set_page_config(page_title="Admin", layout="wide")
 
@@ -11,30 +23,160 @@ ensure_default_admin()
 
 st.title("⚙️ Admin Area")
 
-TAB_SETTINGS, TAB_PRODUCTS, TAB_BLOG, TAB_USERS = st.tabs([
+TAB_SETTINGS, TAB_PRODUCTS, TAB_BLOG, TAB_AFFILIATES, TAB_USERS, TAB_PROFILING = st.tabs([
     "Settings",
     "Products",
     "Blog",
+    "Affiliates",
     "Users",
+    "Profiling",
 ])
 
+
+def flame_html(node, parent_time):
+    # Icicle chart: each call sits under its caller, width proportional to time
+    share = 100 * node["time"] / parent_time if parent_time else 100
+    label = html.escape(node["name"])
+    hue = 10 + zlib.crc32(node["name"].encode("utf-8")) % 45
+    children = "".join(flame_html(child, node["time"]) for child in node["children"])
+    return (
+        f'<div style="width:{share:.3f}%;min-width:0">'
+        f'<div title="{label}: {node["time"] * 1000:.1f} ms" style="background:hsl({hue},85%,62%);'
+        'border:1px solid #fff;font-size:11px;padding:1px 3px;overflow:hidden;white-space:nowrap;text-overflow:ellipsis">'
+        f'{label} {node["time"] * 1000:.1f} ms</div>'
+        f'<div style="display:flex">{children}</div></div>'
+    )
+
+
 with TAB_SETTINGS:
     st.subheader("Site Settings")
     site_name = st.text_input("Site name", value=repo.get_setting("site_name", "Affiliate eShop") or "Affiliate eShop")
+    site_url = st.text_input("Public site URL (used in sitemap and RSS)", value=repo.get_setting("site_url", "") or "")
+    sitemap_files_url = st.text_input(
+        "Public URL of the sitemap files (blank for <site URL>/sitemaps)",
+        value=repo.get_setting("sitemap_files_url", "") or "",
+    )
     if st.button("Save settings"):
         repo.set_setting("site_name", site_name)
+        repo.set_setting("site_url", site_url.strip())
+        repo.set_setting("sitemap_files_url", sitemap_files_url.strip())
         st.success("Settings saved")
+    st.markdown("---")
+    st.subheader("Sitemap & RSS")
+    if st.button("Generate sitemap and RSS"):
+        try:
+            result = generate_sitemaps()
+            posts_count = generate_rss()
+            st.success(
+                f"{result['urls']} URLs in {result['shards']} sitemap files "
+                f"({result['written']} rewritten, {result['skipped']} unchanged); RSS has {posts_count} posts"
+            )
+        except Exception as e:
+            st.error(f"Generation failed: {e}")
+    st.markdown("---")
+    st.subheader("Content generation (LLM)")
+    llm_base_url = st.text_input("API base URL (blank for OpenAI)", value=repo.get_setting("llm_base_url", "") or "")
+    llm_model = st.text_input("Model", value=repo.get_setting("llm_model", "gpt-4o-mini") or "gpt-4o-mini")
+    if os.environ.get("OPENAI_API_KEY"):
+        st.caption("API key: read from the OPENAI_API_KEY environment variable.")
+    else:
+        st.caption("API key: set the OPENAI_API_KEY environment variable (not needed for local servers).")
+    llm_rpm = st.number_input("Requests per minute", min_value=1, value=int(repo.get_setting("llm_requests_per_minute", "60") or 60))
+    llm_tpm = st.number_input("Tokens per minute", min_value=100, value=int(repo.get_setting("llm_tokens_per_minute", "90000") or 90000))
+    if st.button("Save LLM settings"):
+        repo.set_setting("llm_base_url", llm_base_url.strip())
+        repo.set_setting("llm_model", llm_model.strip())
+        repo.set_setting("llm_requests_per_minute", str(int(llm_rpm)))
+        repo.set_setting("llm_tokens_per_minute", str(int(llm_tpm)))
+        st.success("LLM settings saved")
+    st.markdown("---")
+    st.subheader("Public snapshot")
+    st.caption("Shop and Blog read from a periodically published read-only copy of the catalog and blog.")
+    max_age = st.number_input(
+        "Maximum snapshot staleness (seconds)",
+        min_value=1,
+        value=get_snapshot_max_age(),
+    )
+    snapshot_age = get_snapshot_age()
+    if snapshot_age is None:
+        st.info("No snapshot published yet.")
+    elif snapshot_age > max_age:
+        st.warning(f"Snapshot is {snapshot_age:.0f}s old (limit {max_age}s); it is republished on the next public page view.")
+    else:
+        st.write(f"Snapshot age: {snapshot_age:.0f}s (limit {max_age}s)")
+    if st.button("Save staleness"):
+        repo.set_setting("snapshot_max_age_seconds", str(int(max_age)))
+        st.success("Staleness saved")
+    if st.button("Publish snapshot now"):
+        publish_snapshot()
+        st.success("Snapshot published")
+    st.markdown("---")
+    st.subheader("Click retention")
+    retention_days = st.number_input(
+        "Keep clicks in the main database for (days)",
+        min_value=1,
+        value=int(repo.get_setting("click_retention_days", "90") or 90),
+    )
+    st.caption("Clicks that order attribution may still need (within its lookback window) are kept regardless.")
+    if st.button("Save retention"):
+        repo.set_setting("click_retention_days", str(int(retention_days)))
+        st.success("Retention saved")
+    if st.button("Archive old clicks now"):
+        result = archive_old_clicks(int(retention_days))
+        st.success(
+            f"Archived {result['archived']} clicks in {result['batches']} batches, "
+            f"freed {result['vacuumed_pages']} pages"
+        )
 
 with TAB_PRODUCTS:
-    st.subheader("Import products from JSON feed")
+    st.subheader("Import products from feed")
+    feed_format = st.selectbox("Feed format", list(FEED_FORMATS), format_func=FEED_FORMATS.get)
     feed_url = st.text_input("Feed URL")
     if st.button("Import now") and feed_url:
         try:
-            created, updated = import_products_from_json_feed(feed_url)
+            created, updated = import_products_from_feed(feed_url, feed_format)
             st.success(f"Imported products. Created: {created}, Updated: {updated}")
         except Exception as e:
             st.error(f"Import failed: {e}")
     st.markdown("---")
+    st.subheader("Generate descriptions")
+    if st.button("Generate missing product descriptions"):
+        try:
+            result = generate_product_descriptions()
+            st.success(
+                f"Wrote {result['written']} descriptions "
+                f"(generated {result['generated']}, from cache {result['cached']}, failed {result['failed']})"
+            )
+        except Exception as e:
+            st.error(f"Generation failed: {e}")
+    st.markdown("---")
+    st.subheader("Related products")
+    col_update, col_rebuild = st.columns(2)
+    with col_update:
+        if st.button("Update for new products"):
+            count = update_related_products()
+            st.success(f"Updated related products for {count} new products")
+    with col_rebuild:
+        if st.button("Full rebuild"):
+            count = rebuild_related_products()
+            st.success(f"Rebuilt related products for {count} products")
+    st.markdown("---")
+    st.subheader("Duplicate offers")
+    st.caption("Imports group near-identical products from different feeds; the shop shows the cheapest offer of each group.")
+    dedupe_similarity = st.slider(
+        "Minimum similarity to count as a duplicate",
+        min_value=0.5,
+        max_value=1.0,
+        step=0.05,
+        value=float(repo.get_setting(SIMILARITY_KEY, str(DEFAULT_SIMILARITY)) or DEFAULT_SIMILARITY),
+    )
+    if st.button("Save similarity"):
+        repo.set_setting(SIMILARITY_KEY, str(dedupe_similarity))
+        st.success("Similarity saved; rebuild to apply it to existing products")
+    if st.button("Rebuild duplicate groups"):
+        result = rebuild_duplicate_groups()
+        st.success(f"Indexed {result['products']} products: {result['duplicates']} duplicates in {result['groups']} groups")
+    st.markdown("---")
     st.subheader("Existing products")
     products = repo.list_products(active_only=False)
     for p in products:
@@ -66,6 +208,7 @@ with TAB_PRODUCTS:
                 )
                 st.success("Saved")
             if st.button("Delete", key=f"del_{p['id']}"):
+                remove_product(p["id"], commit=False)
                 repo.delete_product(p["id"])
                 st.warning("Deleted. Reload the page to refresh list.")
 
@@ -81,6 +224,18 @@ with TAB_BLOG:
             repo.create_blog_post(title, content_md, status)
             st.success("Post saved")
     st.markdown("---")
+    st.subheader("Generate posts")
+    topics = st.text_area("Topics (one per line)")
+    if st.button("Generate drafts") and topics.strip():
+        try:
+            result = generate_blog_posts(topics.splitlines(), status="draft")
+            st.success(
+                f"Created {result['written']} drafts "
+                f"(generated {result['generated']}, from cache {result['cached']}, failed {result['failed']})"
+            )
+        except Exception as e:
+            st.error(f"Generation failed: {e}")
+    st.markdown("---")
     st.subheader("Existing posts")
     posts = repo.list_blog_posts()
     for p in posts:
@@ -92,6 +247,38 @@ with TAB_BLOG:
                 repo.update_blog_post(p["id"], e_title, e_content, e_status)
                 st.success("Saved")
 
+with TAB_AFFILIATES:
+    st.subheader("Order attribution")
+    lookback_days = st.number_input(
+        "Lookback window (days)",
+        min_value=1,
+        value=int(repo.get_setting("attribution_lookback_days", "30") or 30),
+    )
+    commission_rate = st.number_input(
+        "Commission rate",
+        min_value=0.0,
+        max_value=1.0,
+        value=float(repo.get_setting("commission_rate", "0.05") or 0.05),
+        step=0.01,
+    )
+    if st.button("Save attribution settings"):
+        repo.set_setting("attribution_lookback_days", str(int(lookback_days)))
+        repo.set_setting("commission_rate", str(commission_rate))
+        st.success("Settings saved")
+    if st.button("Run attribution"):
+        result = run_attribution(int(lookback_days), float(commission_rate))
+        st.success(
+            f"Processed {result['orders']} orders. Direct: {result['direct']}, "
+            f"Attributed to clicks: {result['attributed']}, Unattributed: {result['unattributed']}"
+        )
+    st.markdown("---")
+    st.subheader("Commission totals")
+    commissions = repo.list_affiliate_commissions()
+    if not commissions:
+        st.info("No commissions yet.")
+    for c in commissions:
+        st.write(f"{c['name']} ({c['code']}): {c['orders_count']} orders, revenue {c['revenue']:.2f}, commission {c['commission']:.2f}")
+
 with TAB_USERS:
     st.subheader("Users")
     users = repo.list_users()
@@ -107,4 +294,47 @@ with TAB_USERS:
             st.error("Username and password required")
         else:
             repo.create_user(new_username, hash_password(new_password), is_admin=is_admin)
-            st.success("User created")
\ No newline at end of file
+            st.success("User created")
+
+with TAB_PROFILING:
+    st.subheader("Page profiling")
+    profiling_enabled = st.checkbox(
+        "Profile every page rerun (slows pages down; switch off when done)",
+        value=(repo.get_setting("profiling_enabled", "0") or "0") == "1",
+    )
+    profiling_keep = st.number_input(
+        "Profiles to keep",
+        min_value=1,
+        value=int(repo.get_setting("profiling_keep", str(DEFAULT_KEEP)) or DEFAULT_KEEP),
+    )
+    if st.button("Save profiling settings"):
+        repo.set_setting("profiling_enabled", "1" if profiling_enabled else "0")
+        repo.set_setting("profiling_keep", str(int(profiling_keep)))
+        st.success("Profiling settings saved (pages pick them up within a few seconds)")
+    profiling_token = repo.get_setting("profiling_token", "") or ""
+    if profiling_token:
+        st.write(f"Profile just your own reruns by adding `?{QUERY_PARAM}={profiling_token}` to a page URL.")
+    if st.button("Generate new profiling token" if profiling_token else "Generate profiling token"):
+        repo.set_setting("profiling_token", secrets.token_urlsafe(16))
+        st.success("Token generated")
+    st.markdown("---")
+    profile_names = list_profiles()
+    if not profile_names:
+        st.info("No profiles recorded yet.")
+    else:
+        selected_profile = st.selectbox("Profile", profile_names)
+        profile = load_profile(selected_profile)
+        st.caption(f"{profile['page']} · {profile['created_at']} · {profile['outcome']}")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Wall time", f"{profile['wall_seconds'] * 1000:.0f} ms")
+        col2.metric("Database", f"{profile['breakdown']['db'] * 1000:.0f} ms")
+        col3.metric("Rendering", f"{profile['breakdown']['rendering'] * 1000:.0f} ms")
+        col4.metric("Python", f"{profile['breakdown']['python'] * 1000:.0f} ms")
+        st.markdown(flame_html(profile["tree"], profile["tree"]["time"]), unsafe_allow_html=True)
+        st.subheader("Top functions by own time")
+        rows = ["| Function | Category | Calls | Own ms | Cumulative ms |", "|---|---|---:|---:|---:|"]
+        for f in profile["top"]:
+            rows.append(
+                f"| `{f['name']}` | {f['category']} | {f['calls']} | {f['tottime'] * 1000:.2f} | {f['cumtime'] * 1000:.2f} |"
+            )
+        st.markdown("\n".join(rows))
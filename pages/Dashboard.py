@@ -1,17 +1,39 @@
 import streamlit as st
 from app import repositories as repo
+from app.click_filter import get_click_filter
+from app.profiling import profile_page
 
 st.set_page_config(page_title="Dashboard", layout="wide")
 
-st.title("📊 Dashboard")
+params = st.experimental_get_query_params()
 
-st.caption("Basic analytics snapshot")
+with profile_page("Dashboard", params):
+    st.title("📊 Dashboard")
 
-products = repo.list_products(active_only=False)
-posts = repo.list_blog_posts()
-affiliates = repo.list_affiliates()
+    st.caption("Basic analytics snapshot")
 
-col1, col2, col3 = st.columns(3)
-col1.metric("Products", len(products))
-col2.metric("Blog posts", len(posts))
-col3.metric("Affiliates", len(affiliates))
\ No newline at end of file
+    products = repo.list_products(active_only=False, projection="list")
+    posts = repo.list_blog_posts(projection="list")
+    affiliates = repo.list_affiliates()
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Products", len(products))
+    col2.metric("Blog posts", len(posts))
+    col3.metric("Affiliates", len(affiliates))
+
+    click_stats = get_click_filter().stats
+    # Counters live in memory and start at zero with each server process
+    if click_stats["seen"]:
+        st.subheader("Click filter (this server process)")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Clicks seen", click_stats["seen"])
+        col2.metric("Duplicates dropped", click_stats["duplicate"])
+        col3.metric("Fingerprint rate-limited", click_stats["fingerprint_rate"])
+        col4.metric("Referrer rate-limited", click_stats["referrer_rate"])
+
+    st.subheader("Biggest price drops (last 7 days)")
+    drops = repo.list_price_drops(days=7, limit=10)
+    if not drops:
+        st.info("No price drops recorded in the last 7 days.")
+    for d in drops:
+        st.write(f"{d['title']}: {d['previous_price']:.2f} → {d['price']:.2f} {d['currency']} (−{d['drop_pct']:.0f}%)")
@@ -1,49 +1,157 @@
+import html
+import time
+from urllib.parse import quote
+
 import streamlit as st
+from streamlit.web.server.websocket_headers import _get_websocket_headers
 
 from app import repositories as repo
+from app.click_filter import client_fingerprint, log_click_filtered
+from app.profiling import profile_page
 
 st.set_page_config(page_title="Shop", layout="wide")
 
-site_name = repo.get_setting("site_name", "Affiliate eShop") or "Affiliate eShop"
-st.title(f"🛍️ {site_name} – Shop")
-
-with st.sidebar:
-    st.header("Filters")
-    search = st.text_input("Search products")
-    categories = repo.list_categories()
-    category_options = ["All"] + [c["slug"] for c in categories]
-    category_labels = {"All": "All"}
-    for c in categories:
-        category_labels[c["slug"]] = c["name"]
-    selected_category_slug = st.selectbox(
-        "Category",
-        options=category_options,
-        format_func=lambda v: category_labels.get(v, v),
-    )
-    st.markdown("---")
-    st.subheader("Affiliate")
-    affiliate_code = st.text_input("Affiliate code (optional)", value=st.session_state.get("affiliate_code", ""))
-    st.session_state["affiliate_code"] = affiliate_code.strip()
-
-if selected_category_slug == "All":
-    products = repo.list_products(search=search or None, category_slug=None, active_only=True)
-else:
-    products = repo.list_products(search=search or None, category_slug=selected_category_slug, active_only=True)
-
-cols = st.columns(3)
-for idx, p in enumerate(products):
-    with cols[idx % 3]:
-        if p["image_url"]:
-            st.image(p["image_url"], use_column_width=True)
-        st.subheader(p["title"])
-        price_text = f"{p['price']:.2f} {p['currency']}"
-        st.caption((p["category_name"] or "") + (" · " if p["category_name"] else "") + price_text)
-        st.write((p["description"] or "")[:160] + ("…" if p["description"] and len(p["description"]) > 160 else ""))
-        # Build final affiliate target best-effort on the client side as a convenience
-        template = p["affiliate_url_template"] or ""
+params = st.experimental_get_query_params()
+
+
+def request_headers():
+    try:
+        return _get_websocket_headers()
+    except RuntimeError:  # no browser session, e.g. under the test harness
+        return None
+
+
+with profile_page("Shop", params):
+    click_slug = (params.get("go") or [None])[0]
+    if click_slug:
+        # Buy links land here first so the click is logged, through the bot and
+        # double-click filter, before the shopper is sent on to the merchant
+        target = repo.get_product_by_slug(click_slug, snapshot=True)
+        if not target or not target["active"] or not target["affiliate_url_template"]:
+            st.warning("Product not found.")
+            st.stop()
+        aff = (params.get("aff") or [""])[0]
+        affiliate = repo.get_affiliate_by_code(aff) if aff else None
+        headers = request_headers()
+        log_click_filtered(
+            target["id"],
+            affiliate["id"] if affiliate else None,
+            (headers or {}).get("Referer"),
+            client_fingerprint(headers),
+        )
+        url = target["affiliate_url_template"].replace("{affiliate_code}", aff) if aff else target["affiliate_url_template"]
+        st.markdown(f'<meta http-equiv="refresh" content="0; url={html.escape(url)}">', unsafe_allow_html=True)
+        st.markdown(f"Taking you to the store… [Continue]({url})")
+        st.stop()
+
+    site_name = repo.get_setting("site_name", "Affiliate eShop", snapshot=True) or "Affiliate eShop"
+    st.title(f"🛍️ {site_name} – Shop")
+
+    product_slug = (params.get("product") or [None])[0]
+    category_param = (params.get("category") or [None])[0]
+
+    with st.sidebar:
+        st.header("Filters")
+        search = st.text_input("Search products")
+        categories = repo.list_categories(snapshot=True)
+        category_options = ["All"] + [c["slug"] for c in categories]
+        category_labels = {"All": "All"}
+        for c in categories:
+            category_labels[c["slug"]] = c["name"]
+        selected_category_slug = st.selectbox(
+            "Category",
+            options=category_options,
+            index=category_options.index(category_param) if category_param in category_options else 0,
+            format_func=lambda v: category_labels.get(v, v),
+        )
+        st.markdown("---")
+        st.subheader("Affiliate")
+        affiliate_code = st.text_input("Affiliate code (optional)", value=st.session_state.get("affiliate_code", ""))
+        st.session_state["affiliate_code"] = affiliate_code.strip()
+
+
+    def buy_link(product):
+        # Goes through the click redirect above; the affiliate code rides along
+        # because the redirect opens in a new session
+        if not product["affiliate_url_template"]:
+            return "#"
         aff = st.session_state.get("affiliate_code", "")
-        if template:
-            target = template.replace("{affiliate_code}", aff) if aff else template
+        return f"./Shop?go={product['slug']}" + (f"&aff={quote(aff)}" if aff else "")
+
+    def price_sparkline(history, days, width=220, height=40):
+        # Inline SVG step line of (epoch seconds, price) points over the last
+        # `days` up to now. The first point may predate the window (the price
+        # in force when it opened), so it is drawn from the left edge.
+        now = time.time()
+        start = max(history[0][0], now - days * 86400)
+        prices = [price for _, price in history]
+        low, high = min(prices), max(prices)
+        span_x = max(now - start, 1)
+        span_y = (high - low) or 1
+
+        def xy(t, price):
+            return (max(t, start) - start) / span_x * width, height - 2 - (price - low) / span_y * (height - 4)
+
+        x, y = xy(*history[0])
+        path = [f"M{x:.1f},{y:.1f}"]
+        for t, price in history[1:]:
+            x, y = xy(t, price)
+            path.append(f"H{x:.1f}V{y:.1f}")
+        path.append(f"H{width}")
+        return (
+            f'<svg width="{width}" height="{height}" viewBox="0 0 {width} {height}">'
+            f'<path d="{"".join(path)}" fill="none" stroke="#e8743b" stroke-width="2"/></svg>'
+        )
+
+
+    if product_slug:
+        product = repo.get_product_by_slug(product_slug, snapshot=True)
+        if not product or not product["active"]:
+            st.error("Product not found")
         else:
-            target = "#"
-        st.markdown(f"[Buy now]({target})")
\ No newline at end of file
+            col1, col2 = st.columns([1, 2])
+            with col1:
+                if product["image_url"]:
+                    st.image(product["image_url"], use_column_width=True)
+            with col2:
+                st.subheader(product["title"])
+                st.caption((product["category_name"] or "") + (" · " if product["category_name"] else "") + f"{product['price']:.2f} {product['currency']}")
+                history_days = 90
+                history = repo.get_price_history(product["id"], days=history_days, snapshot=True)
+                if len(history) > 1:
+                    was = history[0][1]
+                    if was > product["price"]:
+                        st.markdown(f"**⬇ Price down {100 * (was - product['price']) / was:.0f}%** in the last {history_days} days (was {was:.2f} {product['currency']})")
+                    st.markdown(price_sparkline(history, history_days), unsafe_allow_html=True)
+                    st.caption(f"Price over the last {history_days} days")
+                st.write(product["description"] or "")
+                st.markdown(f"[Buy now]({buy_link(product)})")
+            related = repo.list_related_products(product["id"], snapshot=True)
+            if related:
+                st.markdown("---")
+                st.subheader("You may also like")
+                related_cols = st.columns(4)
+                for idx, r in enumerate(related):
+                    with related_cols[idx % 4]:
+                        if r["image_url"]:
+                            st.image(r["image_url"], use_column_width=True)
+                        st.markdown(f"[{r['title']}](./Shop?product={r['slug']})")
+                        st.caption(f"{r['price']:.2f} {r['currency']}")
+            st.markdown("[← Back to all products](./Shop)")
+        st.stop()
+
+    if selected_category_slug == "All":
+        products = repo.list_products(search=search or None, category_slug=None, active_only=True, snapshot=True, projection="list", collapse_duplicates=True)
+    else:
+        products = repo.list_products(search=search or None, category_slug=selected_category_slug, active_only=True, snapshot=True, projection="list", collapse_duplicates=True)
+
+    cols = st.columns(3)
+    for idx, p in enumerate(products):
+        with cols[idx % 3]:
+            if p["image_url"]:
+                st.image(p["image_url"], use_column_width=True)
+            st.subheader(p["title"])
+            price_text = f"{p['price']:.2f} {p['currency']}"
+            st.caption((p["category_name"] or "") + (" · " if p["category_name"] else "") + price_text)
+            st.write((p["excerpt"] or "")[:160] + ("…" if p["excerpt"] and len(p["excerpt"]) > 160 else ""))
+            st.markdown(f"[Buy now]({buy_link(p)}) · [Details](./Shop?product={p['slug']})")
\ No newline at end of file
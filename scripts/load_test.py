@@ -0,0 +1,318 @@
+"""Load test for the Streamlit pages, one process per simulated shopper.
+
+Drives N simulated shoppers at once through the home, Shop, Blog and
+Dashboard pages with Streamlit's AppTest, against a freshly seeded
+synthetic database, and reports rerun latency percentiles and throughput
+per level.
+
+AppTest swaps in a process-wide Streamlit runtime, so each shopper runs in
+its own process with its own SQLite connection, snapshot and caches. A
+level of N is therefore N single-user app instances sharing the database
+files and the CPU. It says nothing about how many sessions one server
+process can carry: contention on its shared connection, snapshot and
+script runner threads is not exercised.
+
+    python scripts/load_test.py --sessions 1,2,4,8 --reruns 25
+    python scripts/load_test.py --compare data/loadtests/<earlier run>.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, PROJECT_ROOT)
+
+# Recorded with every run so results are not read as one instance's concurrency
+ISOLATION = "process-per-session"
+ISOLATION_NOTE = (
+    "each session is a separate process with its own connection and caches; "
+    "shared-connection contention within one instance is not measured"
+)
+
+WORDS = (
+    "wireless bluetooth speaker portable waterproof leather wallet running shoes "
+    "coffee grinder stainless steel mug organic tea yoga mat desk lamp mechanical "
+    "keyboard gaming mouse usb charger travel backpack camping tent kitchen knife"
+).split()
+
+
+def seed_database(products: int, posts: int, categories: int, seed: int) -> Dict[str, List[str]]:
+    # Imported here so APP_DATA_DIR is already pointing at the scratch directory
+    from app.database import get_connection, publish_snapshot
+    from app.utils import slugify, utc_now_iso
+
+    rng = random.Random(seed)
+    conn = get_connection()
+    now = utc_now_iso()
+    category_rows = [(f"Category {i}", f"category-{i}") for i in range(categories)]
+    conn.executemany("INSERT INTO categories (name, slug) VALUES (?, ?)", category_rows)
+    product_rows = []
+    for i in range(products):
+        title = " ".join(rng.sample(WORDS, 3)).title() + f" {i}"
+        product_rows.append((
+            title,
+            slugify(title),
+            " ".join(rng.choice(WORDS) for _ in range(60)),
+            round(rng.uniform(5, 500), 2),
+            "USD",
+            None,
+            rng.randint(1, categories),
+            f"https://merchant.example.com/p/{i}?aff={{affiliate_code}}",
+            now,
+        ))
+    conn.executemany(
+        "INSERT INTO products (title, slug, description, price, currency, image_url, category_id, "
+        "affiliate_url_template, active, created_at) VALUES (?,?,?,?,?,?,?,?,1,?)",
+        product_rows,
+    )
+    post_rows = []
+    for i in range(posts):
+        title = f"{' '.join(rng.sample(WORDS, 4)).title()} guide {i}"
+        body = "\n\n".join(" ".join(rng.choice(WORDS) for _ in range(80)) for _ in range(5))
+        post_rows.append((title, slugify(title), body, "published", now, now))
+    conn.executemany(
+        "INSERT INTO blog_posts (title, slug, content_md, status, created_at, updated_at) VALUES (?,?,?,?,?,?)",
+        post_rows,
+    )
+    conn.commit()
+    publish_snapshot()
+    return {
+        "categories": [slug for _, slug in category_rows],
+        "posts": [row[1] for row in post_rows],
+        "products": [row[1] for row in product_rows],
+    }
+
+
+class Session:
+    # One simulated shopper: its own AppTest per page, so widget state persists
+    # between reruns the way it does for a real browser session.
+
+    def __init__(self, rng: random.Random, catalog: Dict[str, List[str]], timeout: float):
+        from streamlit.testing.v1 import AppTest
+
+        self.rng = rng
+        self.catalog = catalog
+        self.pages = {
+            name: AppTest.from_file(os.path.join(PROJECT_ROOT, path), default_timeout=timeout)
+            for name, path in (
+                ("home", "streamlit_app.py"),
+                ("shop", "pages/Shop.py"),
+                ("blog", "pages/Blog.py"),
+                ("dashboard", "pages/Dashboard.py"),
+            )
+        }
+        # Warm-up run outside the measurement; widgets only exist after a first run
+        for at in self.pages.values():
+            at.run()
+
+    def _page(self, name: str, params: Optional[Dict[str, str]] = None):
+        at = self.pages[name]
+        at.query_params.clear()
+        for key, value in (params or {}).items():
+            at.query_params[key] = value
+        return at
+
+    def step(self) -> str:
+        rng = self.rng
+        scenario = rng.choices(
+            ["shop_search", "shop_category", "shop_product", "blog_index", "blog_post", "dashboard", "home"],
+            weights=[25, 20, 15, 10, 15, 5, 10],
+        )[0]
+        if scenario == "shop_search":
+            self._page("shop").sidebar.text_input[0].input(rng.choice(WORDS)).run()
+        elif scenario == "shop_category":
+            at = self._page("shop")
+            at.sidebar.selectbox[0].select(rng.choice(["All"] + self.catalog["categories"])).run()
+        elif scenario == "shop_product":
+            self._page("shop", {"product": rng.choice(self.catalog["products"])}).run()
+        elif scenario == "blog_index":
+            self._page("blog").run()
+        elif scenario == "blog_post":
+            self._page("blog", {"post": rng.choice(self.catalog["posts"])}).run()
+        else:
+            self._page(scenario).run()
+        return scenario
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _summarize(latencies: List[float]) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": _percentile(values, 50) * 1000,
+        "p95_ms": _percentile(values, 95) * 1000,
+        "p99_ms": _percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def _session_worker(index: int, reruns: int, catalog: Dict[str, List[str]], seed: int, timeout: float, barrier, results) -> None:
+    # Runs in its own process: AppTest drives a process-wide Streamlit runtime,
+    # so two sessions cannot share an interpreter.
+    samples = []
+    errors = []
+    try:
+        # Built and warmed up before the barrier so page compilation is not timed
+        session = Session(random.Random(seed * 1000 + index), catalog, timeout)
+    except Exception as e:
+        barrier.abort()
+        results.put(([], [repr(e)]))
+        return
+    try:
+        barrier.wait(timeout=_startup_timeout(timeout))
+    except threading.BrokenBarrierError:
+        # Another session failed to start; report rather than leave the parent waiting
+        results.put(([], ["aborted: another session failed to start"]))
+        return
+    for _ in range(reruns):
+        t0 = time.perf_counter()
+        try:
+            scenario = session.step()
+        except Exception as e:  # keep going; a failed rerun is reported, not fatal
+            errors.append(repr(e))
+            continue
+        samples.append((scenario, time.perf_counter() - t0))
+    results.put((samples, errors))
+
+
+def _startup_timeout(timeout: float) -> float:
+    # Covers the warm-up run of each page
+    return timeout * 5
+
+
+def run_level(sessions: int, reruns: int, catalog: Dict[str, List[str]], seed: int, timeout: float) -> Dict:
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(sessions + 1)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_session_worker, args=(i, reruns, catalog, seed, timeout, barrier, results), daemon=True)
+        for i in range(sessions)
+    ]
+    for proc in procs:
+        proc.start()
+    samples: List[tuple] = []
+    errors: List[str] = []
+    try:
+        barrier.wait(timeout=_startup_timeout(timeout))
+    except threading.BrokenBarrierError:
+        pass  # a session failed to start; its error is collected below
+    wall_start = time.perf_counter()
+    pending = len(procs)
+    while pending:
+        try:
+            level_samples, level_errors = results.get(timeout=1.0)
+        except queue.Empty:
+            # A session that died without reporting (crash, OOM kill) would
+            # otherwise leave this loop waiting forever. Exited sessions have
+            # flushed their result, so an empty queue here means none is coming.
+            if any(proc.exitcode is None for proc in procs):
+                continue
+            codes = ", ".join(str(proc.exitcode) for proc in procs)
+            errors.append(f"{pending} session(s) exited without reporting (exit codes: {codes})")
+            break
+        samples.extend(level_samples)
+        errors.extend(level_errors)
+        pending -= 1
+    wall = time.perf_counter() - wall_start
+    for proc in procs:
+        proc.join()
+
+    by_scenario: Dict[str, List[float]] = {}
+    for scenario, latency in samples:
+        by_scenario.setdefault(scenario, []).append(latency)
+    result = {
+        "sessions": sessions,
+        "reruns": len(samples),
+        "errors": len(errors),
+        "wall_s": wall,
+        "throughput_rps": len(samples) / wall if wall else 0.0,
+        **_summarize([latency for _, latency in samples]),
+        "scenarios": {name: _summarize(values) for name, values in sorted(by_scenario.items())},
+    }
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def _print_levels(levels: List[Dict], baseline: Optional[Dict] = None) -> None:
+    previous = {level["sessions"]: level for level in (baseline or {}).get("levels", [])}
+    print(f"{'sessions':>8} {'reruns':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6}")
+    for level in levels:
+        line = (
+            f"{level['sessions']:>8} {level['reruns']:>7} {level['throughput_rps']:>8.1f} "
+            f"{level['p50_ms']:>9.1f} {level['p95_ms']:>9.1f} {level['p99_ms']:>9.1f} {level['errors']:>6}"
+        )
+        old = previous.get(level["sessions"])
+        if old:
+            line += (
+                f"   vs baseline: rps {level['throughput_rps'] - old['throughput_rps']:+.1f}, "
+                f"p95 {level['p95_ms'] - old['p95_ms']:+.1f} ms"
+            )
+        print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", default="1,2,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--reruns", type=int, default=20, help="reruns per session at each level")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-rerun timeout in seconds")
+    parser.add_argument("--out", default=os.path.join(PROJECT_ROOT, "data", "loadtests"), help="results directory")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    # Scratch data directory so the real database is never touched
+    scratch = tempfile.mkdtemp(prefix="eshop-loadtest-")
+    os.environ["APP_DATA_DIR"] = scratch
+    catalog = seed_database(args.products, args.posts, args.categories, args.seed)
+
+    print(f"Isolation: {ISOLATION} ({ISOLATION_NOTE})")
+    levels = []
+    for sessions in [int(v) for v in args.sessions.split(",") if v.strip()]:
+        level = run_level(sessions, args.reruns, catalog, args.seed, args.timeout)
+        levels.append(level)
+        _print_levels([level])
+
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "isolation": ISOLATION,
+        "isolation_note": ISOLATION_NOTE,
+        "levels": levels,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    out_path = os.path.join(args.out, f"loadtest-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {out_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.compare}:")
+        if baseline.get("isolation") != ISOLATION:
+            print(f"Note: the baseline was not recorded with {ISOLATION} isolation; levels may not be comparable")
+        _print_levels(levels, baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
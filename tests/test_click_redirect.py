@@ -0,0 +1,53 @@
+import os
+
+import pytest
+from streamlit.testing.v1 import AppTest
+import streamlit.web.server.websocket_headers as websocket_headers
+
+from app import click_filter, database, repositories as repo
+
+SHOP = os.path.join(os.path.dirname(__file__), os.pardir, "pages", "Shop.py")
+
+
+@pytest.fixture
+def shop(tmp_path, monkeypatch):
+    monkeypatch.setenv("APP_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(database, "_connection_cache", None)
+    monkeypatch.setattr(database, "_snapshot_cache", None)
+    monkeypatch.setattr(click_filter, "_default_filter", None)
+    product_id = repo.create_product(
+        "Trail Shoe", None, 59.0, "EUR", None, None, "https://shop.example/trail?aff={affiliate_code}", True
+    )
+    repo.create_affiliate("Partner", "p1")
+    database.publish_snapshot()
+    return product_id
+
+
+def _click(monkeypatch, headers, **params):
+    monkeypatch.setattr(websocket_headers, "_get_websocket_headers", lambda: headers)
+    at = AppTest.from_file(SHOP)
+    at.query_params.update({"go": "trail-shoe", **params})
+    at.run()
+    assert not at.exception
+    return at
+
+
+def _clicks():
+    return database.get_connection().execute("SELECT product_id, affiliate_id, referrer FROM clicks").fetchall()
+
+
+def test_buy_link_logs_click_and_redirects(shop, monkeypatch):
+    headers = {"User-Agent": "Mozilla/5.0", "Referer": "https://blog.example/post"}
+    at = _click(monkeypatch, headers, aff="p1")
+    affiliate = repo.get_affiliate_by_code("p1")
+    assert [tuple(r) for r in _clicks()] == [(shop, affiliate["id"], "https://blog.example/post")]
+    assert "https://shop.example/trail?aff=p1" in at.markdown[0].value
+
+
+def test_repeat_click_from_same_client_is_dropped(shop, monkeypatch):
+    headers = {"User-Agent": "Mozilla/5.0", "X-Forwarded-For": "203.0.113.7"}
+    _click(monkeypatch, headers)
+    _click(monkeypatch, headers)
+    _click(monkeypatch, dict(headers, **{"X-Forwarded-For": "198.51.100.2"}))
+    assert len(_clicks()) == 2
+    assert click_filter.get_click_filter().stats["duplicate"] == 1